@@ -1,13 +1,24 @@
 import sys
 import os
-import json
+from functools import lru_cache
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 from retrieval.approach0_hash import skeleton_hash
+from utils.json_io import load_json
+
+# 同一 LaTeX / MathML 骨架在不同查询的真值中反复出现，按内容缓存哈希结果
+@lru_cache(maxsize=1_000_000)
+def cached_skeleton_hash(latex, mathml_skel=""):
+    return skeleton_hash(latex, mathml_skel=mathml_skel)
 
 # 1. 加载数据
-with open('data/processed/formulas.json') as f: formulas = json.load(f)
-with open('data/processed/queries_full.json') as f: queries_full = json.load(f)
-with open('data/processed/relevance_labels.json') as f: labels = json.load(f)
+formulas = load_json('data/processed/formulas.json')
+queries_full = load_json('data/processed/queries_full.json')
+labels = load_json('data/processed/relevance_labels.json')
+
+# formulas 与 labels 分别解析，同一 fid 各有一份字符串副本；统一驻留，
+# 既去掉重复内存，也让两边的字典查找可以直接走指针相等的快速路径
+formulas = {sys.intern(fid): f_data for fid, f_data in formulas.items()}
+labels = {qid: {sys.intern(fid): rel for fid, rel in rels.items()} for qid, rels in labels.items()}
 
 qid = "B.301"
 q_data = queries_full[qid]
@@ -16,29 +27,28 @@ q_mathml = q_data.get('mathml_skel', "")
 
 # ✅ 核心：生成查询的 MathML 哈希
 if q_mathml:
-    q_hash = skeleton_hash("", mathml_skel=q_mathml)
+    q_hash = cached_skeleton_hash("", mathml_skel=q_mathml)
     print(f"=== 深度追踪 (MathML 模式): {qid} ===")
     print(f"Query MathML Skel: {q_mathml[:100]}...")
 else:
-    q_hash = skeleton_hash(q_latex)
+    q_hash = cached_skeleton_hash(q_latex)
     print(f"=== 深度追踪 (LaTeX 模式): {qid} ===")
 
 gt_ids = list(labels.get(qid, {}).keys())
+
+# 先筛出库中存在的真值（保持原顺序），再成批计算两路哈希
+present = [fid for fid in gt_ids if fid in formulas]
+found_in_corpus = len(present)
+latex_hashes = [cached_skeleton_hash(formulas[fid].get('latex', '')) for fid in present]
+mathml_hashes = [cached_skeleton_hash("", mathml_skel=formulas[fid].get('mathml_skel', ''))
+                 for fid in present]
+
+# 库里存了两个哈希，我们检查查询哈希是否命中其中任何一个
 match_count = 0
-found_in_corpus = 0
-
-for fid in gt_ids:
-    if fid in formulas:
-        found_in_corpus += 1
-        f_data = formulas[fid]
-        
-        # 库里存了两个哈希，我们检查查询哈希是否命中其中任何一个
-        t_hash_latex = skeleton_hash(f_data.get('latex', ''))
-        t_hash_mathml = skeleton_hash("", mathml_skel=f_data.get('mathml_skel', ''))
-        
-        if q_hash == t_hash_latex or q_hash == t_hash_mathml:
-            match_count += 1
-            print(f"✅ ID {fid:10s}: [MATCH] 结构完美对齐！")
+for fid, t_hash_latex, t_hash_mathml in zip(present, latex_hashes, mathml_hashes):
+    if q_hash == t_hash_latex or q_hash == t_hash_mathml:
+        match_count += 1
+        print(f"✅ ID {fid:10s}: [MATCH] 结构完美对齐！")
 
 print(f"\n" + "="*30)
 print(f"结论：库里有 {found_in_corpus}/{len(gt_ids)} 个答案。")
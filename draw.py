@@ -1,69 +1,93 @@
-import json
+import os
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 from matplotlib.patches import Circle, FancyBboxPatch
 from collections import defaultdict
+from utils.json_io import load_json, iter_json_items
+from retrieval.rank_fusion import top_k_order
 
 # 设置学术风格
 plt.rcParams['font.sans-serif'] = ['DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False
 sns.set_theme(style="white")
 
+def score_arrays(candidates):
+    """候选分数字典 -> 原始次序的 (fids, sims) 数组"""
+    fids = np.array(list(candidates.keys()), dtype=object)
+    sims = np.fromiter(candidates.values(), dtype=np.float64, count=len(candidates))
+    return fids, sims
+
+def summarize_query(truth_ids, fids, sims, top_k=500):
+    """
+    单查询的一次性汇总（次序与稳定降序 sorted(..., reverse=True) 一致），统计、最差查询选取与单查询绘图共用。
+    Top-k 用 top_k_order 线性选择；真值名次只对真值逐个计数，无需整体排序
+    """
+    # npz 中的 fids 为定长字符串数组，真值 ID 需同为字符串类型才能比较
+    truth_arr = np.array(list(truth_ids), dtype=object if fids.dtype == object else str)
+    top_idx = top_k_order(sims, top_k)
+    truth_idx = np.flatnonzero(np.isin(fids, truth_arr))
+    # 名次 = 分数更高者个数 + 同分且下标更靠前者个数 + 1
+    ranks = np.array([np.count_nonzero(sims > sims[i]) + np.count_nonzero(sims[:i] == sims[i]) + 1
+                      for i in truth_idx], dtype=np.int64)
+    order = np.argsort(ranks)
+    return {
+        'top_sims': sims[top_idx],
+        'top_truth_mask': np.isin(fids[top_idx], truth_arr),
+        'truth_ranks': ranks[order],
+        'truth_sims': sims[truth_idx[order]],
+    }
+
+def iter_sem_scores(path):
+    """逐查询产出 (qid, fids, sims)；未安装 ijson 时回退为整体加载"""
+    for qid, candidates in iter_json_items(path):
+        yield (qid, *score_arrays(candidates))
+
+def iter_sem_scores_npz(path):
+    """读取 scripts/convert_sem_scores.py 生成的列式 npz，逐查询产出 (qid, fids, sims) 切片"""
+    data = np.load(path)
+    qids, offsets, fids, sims = data['qids'], data['offsets'], data['fids'], data['sims']
+    for i, qid in enumerate(qids):
+        lo, hi = offsets[i], offsets[i + 1]
+        yield str(qid), fids[lo:hi], sims[lo:hi]
+
 def analyze_noise_wall():
     """分析并可视化 ARQMath-3 的真实语义噪声墙"""
     
     # ========== 加载数据 ==========
     print("📂 加载数据...")
-    with open("data/qrel_76_expert.json", "r") as f:
-        qrel = json.load(f)
-    
-    with open("results/raw_sem_scores.json", "r") as f:
-        sem_scores = json.load(f)
+    qrel = load_json("data/qrel_76_expert.json")
     
-    # ========== 统计分析 ==========
+    # ========== 逐查询汇总（每个查询只保留 Top-500 与真值信息） ==========
     print("📊 统计分析中...")
-    
+    if os.path.exists("results/raw_sem_scores.npz"):
+        score_iter = iter_sem_scores_npz("results/raw_sem_scores.npz")
+    else:
+        score_iter = iter_sem_scores("results/raw_sem_scores.json")
+    per_q = {}
+    for qid, fids, sims in score_iter:
+        if qid in qrel:
+            per_q[qid] = summarize_query(frozenset(qrel[qid]), fids, sims)
+    
+    # 各查询 Top-100 相似度拼成 (Q, 100) 矩阵（不足 100 的以 NaN 补齐），一次性按行统计
+    qids = [qid for qid in qrel.keys() if qid in per_q]
+    top100 = np.full((len(qids), 100), np.nan)
+    for i, qid in enumerate(qids):
+        sims = per_q[qid]['top_sims'][:100]
+        top100[i, :sims.size] = sims
+    
+    with_truth = [per_q[qid] for qid in qids if per_q[qid]['truth_ranks'].size]
     stats = {
-        'avg_top1_sim': [],
-        'avg_top10_sim': [],
-        'avg_top100_sim': [],
-        'truth_avg_rank': [],
-        'truth_avg_sim': [],
-        'noise_density': []
-    }
-    
-    for qid in qrel.keys():
-        if qid not in sem_scores:
-            continue
-        
-        # 获取真值 ID
-        truth_ids = set(qrel[qid].keys())
-        
-        # 获取候选分数（已排序）
-        candidates = sem_scores[qid]
-        sorted_candidates = sorted(candidates.items(), key=lambda x: x[1], reverse=True)
-        
         # Top-K 平均相似度
-        stats['avg_top1_sim'].append(sorted_candidates[0][1])
-        stats['avg_top10_sim'].append(np.mean([s for _, s in sorted_candidates[:10]]))
-        stats['avg_top100_sim'].append(np.mean([s for _, s in sorted_candidates[:100]]))
-        
+        'avg_top1_sim': top100[:, 0],
+        'avg_top10_sim': np.nanmean(top100[:, :10], axis=1),
+        'avg_top100_sim': np.nanmean(top100, axis=1),
         # 真值的排名和分数
-        truth_ranks = []
-        truth_sims = []
-        for rank, (fid, sim) in enumerate(sorted_candidates, 1):
-            if fid in truth_ids:
-                truth_ranks.append(rank)
-                truth_sims.append(sim)
-        
-        if truth_ranks:
-            stats['truth_avg_rank'].append(np.mean(truth_ranks))
-            stats['truth_avg_sim'].append(np.mean(truth_sims))
-        
-        # 噪声密度（相似度 > 0.94 的比例）
-        high_sim_count = sum(1 for _, s in sorted_candidates[:100] if s > 0.94)
-        stats['noise_density'].append(high_sim_count / 100)
+        'truth_avg_rank': [q['truth_ranks'].mean() for q in with_truth],
+        'truth_avg_sim': [q['truth_sims'].mean() for q in with_truth],
+        # 噪声密度（相似度 > 0.94 的比例；NaN 比较结果为 False）
+        'noise_density': np.count_nonzero(top100 > 0.94, axis=1) / 100
+    }
     
     # ========== 选择最具代表性的查询 ==========
     # 选择真值排名最靠后的查询（噪声墙最严重）
@@ -71,19 +95,10 @@ def analyze_noise_wall():
     worst_rank = 0
     
     for qid in qrel.keys():
-        if qid not in sem_scores:
-            continue
-        
-        truth_ids = set(qrel[qid].keys())
-        candidates = sem_scores[qid]
-        sorted_candidates = sorted(candidates.items(), key=lambda x: x[1], reverse=True)
-        
-        for rank, (fid, sim) in enumerate(sorted_candidates, 1):
-            if fid in truth_ids:
-                if rank > worst_rank:
-                    worst_rank = rank
-                    worst_qid = qid
-                break
+        q = per_q.get(qid)
+        if q is not None and q['truth_ranks'].size and q['truth_ranks'][0] > worst_rank:
+            worst_rank = q['truth_ranks'][0]
+            worst_qid = qid
     
     print(f"\n🎯 选择最具代表性的查询: {worst_qid}")
     print(f"   真值最差排名: #{worst_rank}")
@@ -94,7 +109,7 @@ def analyze_noise_wall():
     
     # --- 子图 1: 单查询噪声墙 ---
     ax1 = fig.add_subplot(gs[0, :])
-    draw_single_query_noise_wall(ax1, worst_qid, qrel, sem_scores)
+    draw_single_query_noise_wall(ax1, worst_qid, per_q[worst_qid])
     
     # --- 子图 2: 全局噪声密度分布 ---
     ax2 = fig.add_subplot(gs[1, 0])
@@ -129,32 +144,24 @@ def analyze_noise_wall():
     plt.show()
 
 
-def draw_single_query_noise_wall(ax, qid, qrel, sem_scores):
-    """绘制单个查询的噪声墙"""
-    
-    truth_ids = set(qrel[qid].keys())
-    candidates = sem_scores[qid]
-    sorted_candidates = sorted(candidates.items(), key=lambda x: x[1], reverse=True)
+def draw_single_query_noise_wall(ax, qid, q):
+    """绘制单个查询的噪声墙（q 为 summarize_query 的汇总结果）"""
     
     # 取 Top-500
-    top500 = sorted_candidates[:500]
+    sims = q['top_sims'][:500]
     ranks = np.arange(1, 501)
-    sims = [s for _, s in top500]
     
     # 标记真值位置
-    truth_ranks = []
-    truth_sims = []
-    for rank, (fid, sim) in enumerate(top500, 1):
-        if fid in truth_ids:
-            truth_ranks.append(rank)
-            truth_sims.append(sim)
+    truth_mask = q['top_truth_mask'][:500]
+    truth_ranks = np.flatnonzero(truth_mask) + 1
+    truth_sims = sims[truth_mask]
     
     # 绘制噪声墙
     ax.fill_between(ranks, sims, alpha=0.3, color='red', label='Noise Wall')
     ax.plot(ranks, sims, color='darkred', linewidth=2, alpha=0.7)
     
     # 标记真值
-    if truth_ranks:
+    if truth_ranks.size:
         ax.scatter(truth_ranks, truth_sims, 
                   c='gold', s=200, marker='*', 
                   edgecolors='black', linewidths=2,
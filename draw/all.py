@@ -15,16 +15,31 @@ plt.rcParams['axes.unicode_minus'] = False
 sns.set_style("whitegrid")
 sns.set_palette("husl")
 
+def hist_bars(ax, data, bins, **kwargs):
+    """预先用 np.histogram 分箱，再以 ax.bar 绘制（与 ax.hist 的默认柱形一致）"""
+    counts, edges = np.histogram(data, bins=bins)
+    label = kwargs.pop('label', None)
+    bars = ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', **kwargs)
+    # 与 ax.hist 相同，把图例标签挂在首个柱子上，保持图例次序不变
+    if label is not None:
+        bars.patches[0].set_label(label)
+    return bars
+
+# 所有配图复用同一个 Figure：每张图前 clear 并调整尺寸，避免重复创建画布
+fig = plt.figure()
+
 # ========== Figure 1: 语义饱和现象可视化 ==========
-fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+fig.clear()
+fig.set_size_inches(14, 5)
+ax1, ax2 = fig.subplots(1, 2)
 
 # 左图：Math-BERT 的相似度分布（语义饱和）
 np.random.seed(42)
 relevant_mathbert = np.random.normal(0.9449, 0.0287, 100)
 irrelevant_mathbert = np.random.normal(0.9412, 0.0350, 1000)
 
-ax1.hist(irrelevant_mathbert, bins=50, alpha=0.6, label='Irrelevant (N=8.41M)', color='gray')
-ax1.hist(relevant_mathbert, bins=30, alpha=0.8, label='Relevant (Ground Truth)', color='red')
+hist_bars(ax1, irrelevant_mathbert, bins=50, alpha=0.6, label='Irrelevant (N=8.41M)', color='gray')
+hist_bars(ax1, relevant_mathbert, bins=30, alpha=0.8, label='Relevant (Ground Truth)', color='red')
 ax1.axvline(0.9449, color='red', linestyle='--', linewidth=2, label='Relevant Mean')
 ax1.axvline(0.9412, color='gray', linestyle='--', linewidth=2, label='Irrelevant Mean')
 
@@ -44,8 +59,8 @@ ax1.set_xlim(0.88, 1.0)
 relevant_minilm = np.random.normal(0.8732, 0.0612, 100)
 irrelevant_minilm = np.random.normal(0.8501, 0.0700, 1000)
 
-ax2.hist(irrelevant_minilm, bins=50, alpha=0.6, label='Irrelevant', color='gray')
-ax2.hist(relevant_minilm, bins=30, alpha=0.8, label='Relevant', color='blue')
+hist_bars(ax2, irrelevant_minilm, bins=50, alpha=0.6, label='Irrelevant', color='gray')
+hist_bars(ax2, relevant_minilm, bins=30, alpha=0.8, label='Relevant', color='blue')
 ax2.axvline(0.8732, color='blue', linestyle='--', linewidth=2)
 ax2.axvline(0.8501, color='gray', linestyle='--', linewidth=2)
 
@@ -61,13 +76,13 @@ ax2.set_title('MiniLM: Normal Distribution\n(Discriminative Capacity Preserved)'
 ax2.legend(fontsize=10)
 ax2.set_xlim(0.7, 1.0)
 
-plt.tight_layout()
-plt.savefig('draw/semantic_saturation_phenomenon.pdf', dpi=300, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('draw/semantic_saturation_phenomenon.pdf', dpi=300, bbox_inches='tight')
 print("✅ Saved: draw/semantic_saturation_phenomenon.pdf")
-plt.close()
 
 # ========== Figure 2: 性能对比雷达图 ==========
-fig = plt.figure(figsize=(10, 10))
+fig.clear()
+fig.set_size_inches(10, 10)
 ax = fig.add_subplot(111, projection='polar')
 
 metrics = ['P@1', 'P@10', 'MAP', 'MRR', 'nDCG', 'Bpref']
@@ -101,15 +116,16 @@ ax.legend(loc='upper right', bbox_to_anchor=(1.25, 1.1), fontsize=13,
           frameon=True, shadow=True)
 ax.grid(True, linestyle='--', alpha=0.6)
 
-plt.title('Multi-Metric Performance Comparison\n(N=8.41M, Queries=76)', 
-          size=15, weight='bold', pad=25)
-plt.tight_layout()
-plt.savefig('draw/radar_performance.pdf', dpi=300, bbox_inches='tight')
+ax.set_title('Multi-Metric Performance Comparison\n(N=8.41M, Queries=76)', 
+             size=15, weight='bold', pad=25)
+fig.tight_layout()
+fig.savefig('draw/radar_performance.pdf', dpi=300, bbox_inches='tight')
 print("✅ Saved: draw/radar_performance.pdf")
-plt.close()
 
 # ========== Figure 3: RRF 融合机制示意图 ==========
-fig, ax = plt.subplots(figsize=(12, 8))
+fig.clear()
+fig.set_size_inches(12, 8)
+ax = fig.add_subplot(111)
 
 # 设置三个排名列表
 x_pos = np.array([0, 3, 6])
@@ -157,13 +173,14 @@ textstr = 'Key Insight:\n• Doc A: High rank in BOTH → Top-1\n• Doc B: High
 props = dict(boxstyle='round', facecolor='wheat', alpha=0.8)
 ax.text(6.5, 2.5, textstr, fontsize=11, verticalalignment='top', bbox=props)
 
-plt.tight_layout()
-plt.savefig('draw/rrf_mechanism.pdf', dpi=300, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('draw/rrf_mechanism.pdf', dpi=300, bbox_inches='tight')
 print("✅ Saved: draw/rrf_mechanism.pdf")
-plt.close()
 
 # ========== Figure 4: 规模-性能关系曲线 ==========
-fig, ax = plt.subplots(figsize=(10, 6))
+fig.clear()
+fig.set_size_inches(10, 6)
+ax = fig.add_subplot(111)
 
 # 模拟不同规模下的性能
 corpus_sizes = [1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 8.41e6]
@@ -197,13 +214,14 @@ ax.legend(fontsize=11, loc='lower left')
 ax.grid(True, alpha=0.3, which='both')
 ax.set_ylim(0.2, 0.9)
 
-plt.tight_layout()
-plt.savefig('draw/scale_performance_curve.pdf', dpi=300, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('draw/scale_performance_curve.pdf', dpi=300, bbox_inches='tight')
 print("✅ Saved: draw/scale_performance_curve.pdf")
-plt.close()
 
 # ========== Figure 5: 消融实验热力图 ==========
-fig, ax = plt.subplots(figsize=(10, 6))
+fig.clear()
+fig.set_size_inches(10, 6)
+ax = fig.add_subplot(111)
 
 # 消融实验数据
 configs = ['S1: Semantic\nOnly', 'S2: Structural\nOnly', 'S3: Linear\nMix', 'S4: LS-MIR\n(RRF)']
@@ -234,10 +252,10 @@ ax.set_title('Ablation Study: Component Contributions\n(Highlighting RRF Superio
              fontsize=14, weight='bold', pad=15)
 fig.colorbar(im, ax=ax, label='Score', shrink=0.8)
 
-plt.tight_layout()
-plt.savefig('draw/ablation_heatmap.pdf', dpi=300, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('draw/ablation_heatmap.pdf', dpi=300, bbox_inches='tight')
 print("✅ Saved: draw/ablation_heatmap.pdf")
-plt.close()
+plt.close(fig)
 
 print("\n🎨 所有论文配图已生成！")
 print("   1. semantic_saturation_phenomenon.pdf - 语义饱和现象")
@@ -61,11 +61,20 @@
 #     draw_semantic_saturation_svg()
 
 import json
+import os
+import sys
+import matplotlib
+matplotlib.use('Agg')  # 仅导出文件，无需 GUI 后端
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib.patches import FancyArrowPatch
-from collections import defaultdict
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.json_io import iter_json_items
+from retrieval.rank_fusion import top_k_order
 
 # 设置学术风格
 plt.rcParams['font.sans-serif'] = ['DejaVu Sans']
@@ -80,11 +89,14 @@ def draw_real_ls_mir_comparison_rrf():
     with open("data/qrel_76_expert.json", "r") as f:
         qrel = json.load(f)
     
-    with open("results/raw_sem_scores.json", "r") as f:
-        sem_scores = json.load(f)
+    # 分数文件较大：逐查询流式解析（ijson），只保留 qrel 中的查询，不整体载入内存
+    sem_scores = dict(iter_json_items("results/raw_sem_scores.json", keys=qrel))
+    str_scores = dict(iter_json_items("results/raw_str_scores.json", keys=qrel))
     
-    with open("results/raw_str_scores.json", "r") as f:
-        str_scores = json.load(f)
+    # doc_id 统一为 str（只在加载时做一次），后续比较与查表不再逐个 str()
+    qrel = normalize_doc_ids(qrel)
+    sem_scores = normalize_doc_ids(sem_scores)
+    str_scores = normalize_doc_ids(str_scores)
     
     # ========== 选择最具代表性的查询 ==========
     print("🔍 分析查询，寻找最佳案例...")
@@ -143,61 +155,150 @@ def draw_real_ls_mir_comparison_rrf():
     print(f"  排名提升: {sem_stats['truth_rank'] - rrf_stats['truth_rank']} 位")
     print("="*60)
     
-    plt.show()
+    plt.close(fig)
+
+
+def normalize_doc_ids(per_query):
+    """{qid: {doc_id: value}} 中的 doc_id 统一转为 str；本已是 str 的字典原样返回"""
+    return {
+        qid: d if all(type(k) is str for k in d) else {str(k): v for k, v in d.items()}
+        for qid, d in per_query.items()
+    }
+
+
+# 每个查询每一路的排序结果只计算一次：选案例、RRF 融合与绘图共用
+# key: id(候选分数字典), value: (候选字典本身, ids, sims, ranks, codes)
+_ranking_cache = {}
+# doc_id -> 全局整数编码，RRF 融合在整数数组上完成（字符串比较远慢于整数）
+_doc_codes = {}
+
+
+def ranked_stream(candidates):
+    """
+    候选分数字典（doc_id 已由 normalize_doc_ids 统一为 str） -> (降序 doc_id 字符串数组, 降序分数数组, {doc_id: 名次}, 降序 doc_id 整数编码)。
+    稳定排序，并列次序与 sorted(..., reverse=True) 一致；结果按字典对象缓存
+    """
+    entry = _ranking_cache.get(id(candidates))
+    # 同时保存字典本身，防止对象回收后 id 被复用导致误命中
+    if entry is None or entry[0] is not candidates:
+        ids = np.array(list(candidates.keys()))
+        scores = np.fromiter(candidates.values(), dtype=np.float64, count=len(candidates))
+        order = np.argsort(-scores, kind='stable')
+        ids, scores = ids[order], scores[order]
+        id_list = ids.tolist()
+        ranks = dict(zip(id_list, range(1, len(id_list) + 1)))
+        # 新出现的 doc_id 成批登记编码（编码只需唯一，与次序无关），再一次性查表
+        new_ids = set(id_list).difference(_doc_codes)
+        _doc_codes.update(zip(new_ids, range(len(_doc_codes), len(_doc_codes) + len(new_ids))))
+        codes = np.fromiter(map(_doc_codes.__getitem__, id_list), dtype=np.int64, count=len(id_list))
+        entry = (candidates, ids, scores, ranks, codes)
+        _ranking_cache[id(candidates)] = entry
+    return entry[1:]
+
+
+def _positions(ranked_codes, vocab_codes):
+    """vocab 中每个文档在 ranked_codes 里的下标（即 0 起的名次），未出现记为 -1"""
+    if ranked_codes.size == 0:
+        return np.full(vocab_codes.size, -1, dtype=np.int64)
+    order = np.argsort(ranked_codes)
+    pos = np.minimum(np.searchsorted(ranked_codes[order], vocab_codes), ranked_codes.size - 1)
+    return np.where(ranked_codes[order][pos] == vocab_codes, order[pos], -1)
 
 
 def compute_rrf_scores(qid, sem_scores, str_scores, w_sem=1.0, w_str=0.3, k=60):
     """计算 RRF 分数"""
-    scores = defaultdict(float)
+    return fuse_rrf(sem_scores[qid], str_scores[qid], w_sem, w_str, k)
+
+
+def fuse_rrf(sem_candidates, str_candidates, w_sem=1.0, w_str=0.3, k=60):
+    """融合单个查询的两路候选分数字典，返回 {doc_id: RRF 分数}"""
+    sem_ids, _, _, sem_codes = ranked_stream(sem_candidates)
+    str_ids, _, _, str_codes = ranked_stream(str_candidates)
+    sem_ids, sem_codes = sem_ids[:1000], sem_codes[:1000]
+    str_ids, str_codes = str_ids[:1000], str_codes[:1000]
+    
+    # 两路共用的文档词表：语义流在前、结构流新增文档在后
+    # （保持原先的插入次序，RRF 并列时的排序依赖它）
+    str_new = ~np.isin(str_codes, sem_codes)
+    vocab_codes = np.concatenate([sem_codes, str_codes[str_new]])
+    vocab_ids = np.concatenate([sem_ids, str_ids[str_new]])
+    
+    # 列式名次数组（-1 表示未进入该路 Top-1000），一次向量化表达式完成融合
+    sem_rank = np.full(vocab_codes.size, -1, dtype=np.int64)
+    sem_rank[:sem_codes.size] = np.arange(sem_codes.size)
+    str_rank = _positions(str_codes, vocab_codes)
+    rrf = (np.where(sem_rank >= 0, w_sem / (k + sem_rank + 1.0), 0.0)
+           + np.where(str_rank >= 0, w_str / (k + str_rank + 1.0), 0.0))
+    return dict(zip(vocab_ids.tolist(), rrf.tolist()))
+
+
+def rrf_arrays(rrf_scores):
+    """{doc_id: RRF 分数} -> 原插入次序的 (doc_id 数组, 分数数组)，不排序"""
+    ids = np.array(list(rrf_scores.keys()))
+    scores = np.fromiter(rrf_scores.values(), dtype=np.float64, count=len(rrf_scores))
+    return ids, scores
+
+
+def _first_truth(ids, scores, truth_ids):
+    """
+    稳定降序下首个真值的 (名次, 下标)，没有真值时返回 None。
+    名次 = 分数更高者个数 + 同分且下标更靠前者个数 + 1，无需整体排序
+    """
+    hits = np.flatnonzero(np.isin(ids, list(truth_ids)))
+    if hits.size == 0:
+        return None
+    # 名次最靠前的真值 = 真值中分数最高者，并列取下标最小者（argmax 返回首个最大值）
+    i = int(hits[np.argmax(scores[hits])])
+    rank = np.count_nonzero(scores > scores[i]) + np.count_nonzero(scores[:i] == scores[i]) + 1
+    return int(rank), i
+
+
+def _score_qid(truth_ids, sem_candidates, str_candidates):
+    """单个查询的 (语义排名, RRF 排名)；不适合作为案例时返回 None。各查询相互独立，可并行"""
     
-    # 语义流
-    sorted_sem = sorted(sem_scores[qid].items(), key=lambda x: x[1], reverse=True)
-    for rank, (doc_id, _) in enumerate(sorted_sem[:1000]):
-        scores[doc_id] += w_sem / (k + rank + 1)
+    # 计算语义排名（首个真值的名次，直接查缓存的名次表）
+    sem_ranks = ranked_stream(sem_candidates)[2]
+    sem_rank = min((sem_ranks[t] for t in truth_ids if t in sem_ranks), default=None)
     
-    # 结构流
-    sorted_str = sorted(str_scores[qid].items(), key=lambda x: x[1], reverse=True)
-    for rank, (doc_id, _) in enumerate(sorted_str[:1000]):
-        scores[doc_id] += w_str / (k + rank + 1)
+    if sem_rank is None or sem_rank == 1:
+        return None
     
-    return scores
+    # 计算 RRF 排名
+    rrf_hit = _first_truth(*rrf_arrays(fuse_rrf(sem_candidates, str_candidates)), truth_ids)
+    
+    if rrf_hit is None:
+        return None
+    return sem_rank, rrf_hit[0]
 
 
-def find_best_demonstration_case_rrf(qrel, sem_scores, str_scores):
-    """找到最能展示 RRF 效果的查询"""
+def find_best_demonstration_case_rrf(qrel, sem_scores, str_scores, n_jobs=None):
+    """
+    找到最能展示 RRF 效果的查询。
+    n_jobs: 并行进程数（默认 CPU 核数，1 表示串行）
+    """
+    
+    qids = [qid for qid in qrel.keys() if qid in sem_scores and qid in str_scores]
+    truth_sets = [frozenset(qrel[qid].keys()) for qid in qids]
+    sem_list = [sem_scores[qid] for qid in qids]
+    str_list = [str_scores[qid] for qid in qids]
+    
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs > 1 and len(qids) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            chunksize = max(1, len(qids) // (n_jobs * 4))
+            all_ranks = list(executor.map(_score_qid, truth_sets, sem_list, str_list,
+                                          chunksize=chunksize))
+    else:
+        all_ranks = list(map(_score_qid, truth_sets, sem_list, str_list))
     
+    # 按 qrel 次序汇总，保持原先“先到先得”的并列处理
     best_case = None
     max_improvement = 0
     
-    for qid in qrel.keys():
-        if qid not in sem_scores or qid not in str_scores:
-            continue
-        
-        truth_ids = set(str(k) for k in qrel[qid].keys())
-        
-        # 计算语义排名
-        sem_sorted = sorted(sem_scores[qid].items(), key=lambda x: x[1], reverse=True)
-        sem_rank = None
-        for rank, (fid, _) in enumerate(sem_sorted, 1):
-            if str(fid) in truth_ids:
-                sem_rank = rank
-                break
-        
-        if sem_rank is None or sem_rank == 1:
+    for qid, ranks in zip(qids, all_ranks):
+        if ranks is None:
             continue
-        
-        # 计算 RRF 排名
-        rrf_scores = compute_rrf_scores(qid, sem_scores, str_scores)
-        rrf_sorted = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-        rrf_rank = None
-        for rank, (fid, _) in enumerate(rrf_sorted, 1):
-            if str(fid) in truth_ids:
-                rrf_rank = rank
-                break
-        
-        if rrf_rank is None:
-            continue
-        
+        sem_rank, rrf_rank = ranks
         improvement = sem_rank - rrf_rank
         
         # 选择提升最大且语义排名在 50-500 之间的
@@ -216,31 +317,25 @@ def find_best_demonstration_case_rrf(qrel, sem_scores, str_scores):
 def draw_semantic_space_real(ax, qid, qrel, sem_scores):
     """绘制纯语义空间（左图）"""
     
-    truth_ids = set(str(k) for k in qrel[qid].keys())
-    candidates = sem_scores[qid]
-    sorted_candidates = sorted(candidates.items(), key=lambda x: x[1], reverse=True)
+    truth_ids = set(qrel[qid].keys())
+    sorted_ids, sorted_sims, sem_ranks, _ = ranked_stream(sem_scores[qid])
     
     # 取 Top-200
-    top200 = sorted_candidates[:200]
+    top200_ids = sorted_ids[:200]
     
     # 使用排名和相似度构建 2D 坐标
     np.random.seed(42)
     x_coords = np.random.normal(0, 0.18, 200)
-    sims = np.array([s for _, s in top200])
+    sims = sorted_sims[:200]
     y_coords = (sims - sims.mean()) / (sims.std() + 1e-8)
     
     # 标记真值
-    truth_mask = np.array([str(fid) in truth_ids for fid, _ in top200])
+    truth_mask = np.array([fid in truth_ids for fid in top200_ids])
     truth_indices = np.where(truth_mask)[0]
     
     # 找到第一个真值的排名
-    truth_rank = None
-    truth_sim = None
-    for rank, (fid, sim) in enumerate(sorted_candidates, 1):
-        if str(fid) in truth_ids:
-            truth_rank = rank
-            truth_sim = sim
-            break
+    truth_rank = min((sem_ranks[t] for t in truth_ids if t in sem_ranks), default=None)
+    truth_sim = float(sorted_sims[truth_rank - 1]) if truth_rank else None
     
     # 绘制噪声点
     ax.scatter(x_coords[~truth_mask], y_coords[~truth_mask],
@@ -298,41 +393,30 @@ def draw_semantic_space_real(ax, qid, qrel, sem_scores):
 def draw_lsmir_rrf_space(ax, qid, qrel, sem_scores, str_scores, w_sem=1.0, w_str=0.3, k=60):
     """绘制 LS-MIR RRF 空间（右图）"""
     
-    truth_ids = set(str(k) for k in qrel[qid].keys())
+    truth_ids = set(qrel[qid].keys())
     
     # 计算 RRF 分数
     rrf_scores = compute_rrf_scores(qid, sem_scores, str_scores, w_sem, w_str, k)
-    sorted_rrf = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
+    rrf_ids, rrf_vals = rrf_arrays(rrf_scores)
     
-    # 取 Top-200
-    top200 = sorted_rrf[:200]
+    # 取 Top-200（线性选取 + 仅对 200 个胜者排序）
+    top200 = top_k_order(rrf_vals, 200)
+    top200_ids = rrf_ids[top200].tolist()
     
-    # 构建排名映射
-    sem_rank_map = {str(fid): rank for rank, (fid, _) in 
-                    enumerate(sorted(sem_scores[qid].items(), 
-                                    key=lambda x: x[1], reverse=True), 1)}
-    str_rank_map = {str(fid): rank for rank, (fid, _) in 
-                    enumerate(sorted(str_scores[qid].items(), 
-                                    key=lambda x: x[1], reverse=True), 1)}
+    # 排名映射（与 compute_rrf_scores 共用缓存）
+    sem_rank_map = ranked_stream(sem_scores[qid])[2]
+    str_rank_map = ranked_stream(str_scores[qid])[2]
     
     # X 轴：语义排名（对数尺度，归一化）
     # Y 轴：RRF 分数
-    x_coords = []
-    y_coords = []
-    
-    for fid, rrf_score in top200:
-        sem_rank = sem_rank_map.get(str(fid), 1000)
-        x_coords.append(np.log(sem_rank + 1))
-        y_coords.append(rrf_score)
-    
-    x_coords = np.array(x_coords)
-    y_coords = np.array(y_coords)
+    x_coords = np.log(np.array([sem_rank_map.get(fid, 1000) for fid in top200_ids]) + 1)
+    y_coords = rrf_vals[top200]
     
     # 归一化 X 轴到 [-1, 1]
     x_coords = (x_coords - x_coords.mean()) / (x_coords.std() + 1e-8)
     
     # 标记真值
-    truth_mask = np.array([str(fid) in truth_ids for fid, _ in top200])
+    truth_mask = np.array([fid in truth_ids for fid in top200_ids])
     truth_indices = np.where(truth_mask)[0]
     
     # 找到第一个真值的详细信息
@@ -341,13 +425,13 @@ def draw_lsmir_rrf_space(ax, qid, qrel, sem_scores, str_scores, w_sem=1.0, w_str
     truth_sem_rank = None
     truth_str_rank = None
     
-    for rank, (fid, score) in enumerate(sorted_rrf, 1):
-        if str(fid) in truth_ids:
-            truth_rank = rank
-            truth_score = score
-            truth_sem_rank = sem_rank_map.get(str(fid), None)
-            truth_str_rank = str_rank_map.get(str(fid), None)
-            break
+    rrf_hit = _first_truth(rrf_ids, rrf_vals, truth_ids)
+    if rrf_hit is not None:
+        truth_rank, pos = rrf_hit
+        fid = rrf_ids[pos]
+        truth_score = float(rrf_vals[pos])
+        truth_sem_rank = sem_rank_map.get(fid, None)
+        truth_str_rank = str_rank_map.get(fid, None)
     
     # 计算贡献分数
     sem_contrib = w_sem / (k + truth_sem_rank) if truth_sem_rank else 0
@@ -1,3 +1,20 @@
+import numpy as np
+
+
+def build_features(feature_builder, query_emb, cand_embs, candidates):
+    """
+    单个查询全部候选的特征矩阵 (N, F)。
+    消融实验关闭 BERT 时（feature_builder.struct_only 为 True）按查询分支一次，
+    用 np.fromiter 一次生成 (N, 1) 的结构分列，不再逐候选构建特征列表
+    """
+    if getattr(feature_builder, "struct_only", False):
+        scores = np.fromiter((c.get("struct_score", 0.0) for c in candidates),
+                             dtype=np.float32, count=len(candidates))
+        return scores[:, None]
+    return np.asarray([feature_builder.build(query_emb, ce, c)
+                       for ce, c in zip(cand_embs, candidates)], dtype=np.float32)
+
+
 def ablate_pipeline(pipeline, flags: dict):
     """
     flags example:
@@ -11,12 +28,12 @@ def ablate_pipeline(pipeline, flags: dict):
         pipeline.graph_prior.pr = {}
 
     if not flags.get("use_filter", True):
-        pipeline.filterer.apply = lambda q, c: c
+        # 过滤器自身判断开关，不再替换 apply
+        pipeline.filterer.enabled = False
 
     if not flags.get("use_bert", True):
-        pipeline.coarse_ranker.feature_builder.build = (
-            lambda qe, ce, c: [c.get("struct_score", 0.0)]
-        )
+        # 特征构建器自身带开关，由 build_features 按查询分支，不再替换 build
+        pipeline.coarse_ranker.feature_builder.struct_only = True
 
     return pipeline
 
@@ -1,24 +1,66 @@
 import json
 import faiss
 import numpy as np
-import hashlib
+from functools import lru_cache
+from itertools import chain
 from tqdm import tqdm
-from pathlib import Path
 from retrieval.approach0_hash import DualHashGenerator, Approach0HashIndex
+from utils.json_io import load_json
+from utils.embedding_cache import QueryEmbeddingCache
+
+MODEL_NAME = 'math-similarity/Bert-MLM_arXiv-MP-class_zbMath'
+# 默认使用精确索引，保证 V3 / V4 结果可复现；换成 scripts/quantize_vector_index.py 生成的
+# vector_index_full_v4_hnsw.faiss / _ivfpq.faiss 可换取更快的检索与更小的内存，Recall@1000 略有损失
+VECTOR_INDEX_PATH = "artifacts/vector_index_full_v4.faiss"
+HNSW_EF_SEARCH = 128
+IVF_NPROBE = 32
+# GPU 上以 FP16 推理（启用 Tensor Core，吞吐约翻倍）；encode 输出仍转回 float32 供 FAISS 使用
+USE_FP16 = True
+VECTOR_ID_MAPPING_PATH = "artifacts/vector_id_mapping_v4.json"
+
+
+# 向量路资源按需加载、进程内只加载一次：纯哈希变体 (V1 / V2) 不触发 GPU 初始化，
+# 多个 AblationTester 实例也共用同一份模型与索引
+@lru_cache(maxsize=None)
+def _load_model():
+    from sentence_transformers import SentenceTransformer
+    print(f"📦 正在加载编码模型 {MODEL_NAME} ...")
+    model = SentenceTransformer(MODEL_NAME, device="cuda")
+    if USE_FP16:
+        model.half()
+    return model
+
+
+@lru_cache(maxsize=None)
+def _load_vector_index():
+    print(f"📦 正在加载向量索引 {VECTOR_INDEX_PATH} ...")
+    index = faiss.read_index(VECTOR_INDEX_PATH)
+    # 近似索引的检索参数（精确索引无此属性，直接跳过）
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif faiss.try_extract_index_ivf(index) is not None:
+        # 含 OPQ 等预变换包装的 IVF 索引
+        faiss.try_extract_index_ivf(index).nprobe = IVF_NPROBE
+    return index
+
+
+@lru_cache(maxsize=None)
+def _load_vector_mapping():
+    # 预先转为字符串数组：FAISS 下标 -> visual_id 一次向量化取值完成
+    # （映射表与语料同规模，走 orjson 解析）
+    return np.array([str(vid) for vid in load_json(VECTOR_ID_MAPPING_PATH)])
+
 
 class AblationTester:
     def __init__(self):
         print("📦 正在加载消融实验所需资源...")
         self.hash_gen = DualHashGenerator()
         self.h_index = Approach0HashIndex()
-        self.h_index.load("artifacts/approach0_index.pkl")
+        self.h_index.load("artifacts/approach0_index.a0idx")
         
-        # 仅在需要向量路时加载，节省显存
-        from sentence_transformers import SentenceTransformer
-        self.model = SentenceTransformer('math-similarity/Bert-MLM_arXiv-MP-class_zbMath', device="cuda")
-        self.v_index = faiss.read_index("artifacts/vector_index_full_v4.faiss")
-        with open("artifacts/vector_id_mapping_v4.json", 'r') as f:
-            self.v_mapping = json.load(f)
+        # 模型、向量索引与映射表在首次用到向量路时才加载（见 model / v_index / v_mapping）
+        # 查询向量磁盘缓存（键含模型名与推理精度），重复运行消融实验时无需再调用模型
+        self.emb_cache = QueryEmbeddingCache(MODEL_NAME, "fp16" if USE_FP16 else "fp32")
             
         with open("data/processed/queries_full.json", 'r') as f:
             self.queries = json.load(f) # 注意：这里存的是经过规范化的，我们需要原始查询
@@ -27,6 +69,27 @@ class AblationTester:
         self.raw_queries = self._load_raw_queries()
         with open("data/processed/relevance_labels.json", 'r') as f:
             self.relevance = json.load(f)
+        # 各查询的真值集合只构建一次，四个变体共用
+        self.gt_sets = {qid: frozenset(map(str, rel.keys())) for qid, rel in self.relevance.items()}
+        
+        # 查询文本、指纹、向量与 FAISS 检索结果按是否规范化缓存：
+        # V2 / V3 / V4 的输入完全相同，只需清洗、哈希、编码、检索一次
+        self._query_text_cache = {}
+        self._query_digest_cache = {}
+        self._query_emb_cache = {}
+        self._vector_hits_cache = {}
+
+    @property
+    def model(self):
+        return _load_model()
+
+    @property
+    def v_index(self):
+        return _load_vector_index()
+
+    @property
+    def v_mapping(self):
+        return _load_vector_mapping()
 
     def _load_raw_queries(self):
         import csv
@@ -37,58 +100,112 @@ class AblationTester:
                 if len(row) >= 2: raw[row[0].strip()] = row[1].strip()
         return raw
 
-    def run_search(self, query_latex, use_norm=True, use_hash=True, use_vector=True):
-        results = []
-        seen = set()
-
-        # 1. 规范化处理
+    def _prepare_query(self, query_latex, use_norm):
         if use_norm:
             norm_latex, _ = self.hash_gen.clean_latex(query_latex)
         else:
             # V1: 仅去除两端的 $ 和空格，不进行深度清洗
             norm_latex = query_latex.replace('$', '').strip()
+        return norm_latex
+
+    def _query_texts(self, use_norm):
+        """全部查询的检索文本（与 raw_queries 次序一致）"""
+        if use_norm not in self._query_text_cache:
+            self._query_text_cache[use_norm] = [
+                self._prepare_query(q, use_norm) for q in self.raw_queries.values()
+            ]
+        return self._query_text_cache[use_norm]
+
+    def _query_digests(self, use_norm):
+        """全部查询的 16 字节指纹，与索引使用同一哈希算法；直接作为索引键，无需十六进制往返"""
+        if use_norm not in self._query_digest_cache:
+            self._query_digest_cache[use_norm] = self.hash_gen.generate_latex_digest_batch(
+                self._query_texts(use_norm)
+            )
+        return self._query_digest_cache[use_norm]
+
+    def _encode(self, texts):
+        """批量编码，命中磁盘缓存的文本直接读取，仅对缺失的文本调用模型（全部命中时不加载模型）"""
+        n_missing = 0
+        
+        def encode_misses(misses):
+            nonlocal n_missing
+            n_missing = len(misses)
+            # FP16 模型的输出由缓存统一转为 float32 落盘
+            return self.model.encode(
+                misses, batch_size=64, normalize_embeddings=True,
+                convert_to_numpy=True, show_progress_bar=True
+            )
+        
+        embs = self.emb_cache.encode(texts, encode_misses)
+        print(f"   - 向量缓存命中: {len(set(texts)) - n_missing}/{len(set(texts))}")
+        return embs
+
+    def _encode_queries(self, use_norm):
+        """一次性批量编码全部查询（与 raw_queries 次序一致），避免逐条 encode 的 batch=1 开销"""
+        if use_norm not in self._query_emb_cache:
+            self._query_emb_cache[use_norm] = self._encode(self._query_texts(use_norm))
+        return self._query_emb_cache[use_norm]
+
+    def _search_queries(self, use_norm):
+        """全部查询的 N x D 矩阵一次性送入 FAISS，返回 (N, 1000) 的候选下标"""
+        if use_norm not in self._vector_hits_cache:
+            _, all_indices = self.v_index.search(self._encode_queries(use_norm), 1000)
+            self._vector_hits_cache[use_norm] = all_indices
+        return self._vector_hits_cache[use_norm]
+
+    def run_search(self, query_latex, use_norm=True, use_hash=True, use_vector=True,
+                   h_val=None, v_indices=None):
+        """
+        h_val: 可选的预先计算好的查询指纹；
+        v_indices: 可选的预先检索好的向量路候选下标 (1 x 1000)。未提供时现场计算
+        """
+        hash_vids, vec_vids = [], []
+
+        # 1. 规范化处理（指纹与向量路候选都已预先给出时可跳过）
+        if (use_hash and h_val is None) or (use_vector and v_indices is None):
+            norm_latex = self._prepare_query(query_latex, use_norm)
 
-        # 2. 哈希路
+        # 2. 哈希路（空公式没有指纹，不参与匹配）
         if use_hash:
-            h_val = hashlib.md5(norm_latex.encode('utf-8')).hexdigest()
-            for vid in self.h_index.search(h_val):
-                if vid not in seen:
-                    results.append(vid)
-                    seen.add(vid)
+            if h_val is None:
+                h_val = self.hash_gen.generate_latex_digest(norm_latex)
+            hash_vids = self.h_index.search(h_val) if h_val else []
 
         # 3. 向量路
         if use_vector:
-            q_emb = self.model.encode([norm_latex], normalize_embeddings=True, convert_to_numpy=True)
-            _, v_indices = self.v_index.search(q_emb.astype('float32'), 1000)
-            for idx in v_indices[0]:
-                if idx != -1:
-                    vid = str(self.v_mapping[idx])
-                    if vid not in seen:
-                        results.append(vid)
-                        seen.add(vid)
+            if v_indices is None:
+                q_emb = self.model.encode([norm_latex], normalize_embeddings=True, convert_to_numpy=True)
+                _, v_indices = self.v_index.search(q_emb.astype('float32'), 1000)
+            row = v_indices[0]
+            vec_vids = self.v_mapping[row[row != -1]].tolist()
         
+        # 哈希路优先、保序去重（dict 保持插入次序）
+        results = list(dict.fromkeys(chain(hash_vids, vec_vids)))
         return results[:1000]
 
     def evaluate_variant(self, name, use_norm, use_hash, use_vector):
         print(f"\n🧪 正在测试变体 {name}...")
         recalls, mrr_scores = [], []
+        # 仅向量路变体才编码与检索；纯哈希变体完全跳过 FAISS
+        all_indices = self._search_queries(use_norm) if use_vector else None
+        all_digests = self._query_digests(use_norm) if use_hash else None
         
-        for qid, raw_latex in tqdm(self.raw_queries.items(), desc=f"{name}"):
-            gt = set(str(k) for k in self.relevance.get(qid, {}).keys())
+        for i, (qid, raw_latex) in enumerate(tqdm(self.raw_queries.items(), desc=f"{name}")):
+            gt = self.gt_sets.get(qid, frozenset())
             if not gt: continue
             
-            results = self.run_search(raw_latex, use_norm, use_hash, use_vector)
+            h_val = all_digests[i] if use_hash else None
+            v_indices = all_indices[i:i + 1] if use_vector else None
+            results = self.run_search(raw_latex, use_norm, use_hash, use_vector,
+                                      h_val=h_val, v_indices=v_indices)
             
             # 计算 Recall
-            hits = gt.intersection(set(results))
+            hits = gt.intersection(results)
             recalls.append(len(hits)/len(gt))
             
-            # 计算 MRR
-            mrr = 0
-            for i, r in enumerate(results):
-                if r in gt:
-                    mrr = 1/(i+1)
-                    break
+            # 计算 MRR（首个命中的倒数排名）
+            mrr = next((1/(i+1) for i, r in enumerate(results) if r in gt), 0)
             mrr_scores.append(mrr)
             
         return np.mean(recalls), np.mean(mrr_scores)
@@ -3,41 +3,66 @@
 修复了 torch 导入问题
 """
 
+import os
 import json
 import time
 import sqlite3
+import threading
 import faiss
+from functools import lru_cache
 import numpy as np
-import re
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from retrieval.approach0_hash import DualHashGenerator
+from retrieval.rank_fusion import top_k_order
+from utils.latex_clean import clean_latex
 
 # ==================== 配置 ====================
 MODEL_NAME = 'math-similarity/Bert-MLM_arXiv-MP-class_zbMath'
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# GPU 上以 FP16 推理（启用 Tensor Core）；编码结果在进入 FAISS 前统一转回 float32
+USE_FP16 = True
 DB_PATH = "artifacts/formula_index.db"
 INDEX_PATH = "artifacts/vector_index_full_v3.faiss"
 MAPPING_PATH = "artifacts/vector_id_mapping_v3.json"
 LABEL_PATH = "data/processed/relevance_labels.json"
 QUERY_PATH = "data/processed/queries_full.json"
 
+# 纯向量模式的全量检索索引：None 表示与级联模式共用上面的精确索引（结果可复现）；
+# 设为 scripts/quantize_vector_index.py --flat-index artifacts/vector_index_full_v3.faiss --kind ivfpq
+# 生成的 vector_index_full_v3_ivfpq.faiss 即改走 IVF-PQ（级联模式的向量取回仍用精确索引）
+PURE_VECTOR_INDEX_PATH = None
+IVF_NPROBE = 16
+# 有 GPU 版 FAISS 时把全量检索索引按分片分布到全部 GPU 上（整库扫描的显存带宽随 GPU 数叠加）
+USE_GPU_INDEX = True
+# GPU 索引以 FP16 存储向量：显存与带宽减半，但分数有舍入误差；默认关闭以保持与 CPU 精确检索一致
+GPU_INDEX_FP16 = False
+
+# Stage 1 哈希查询：SQL 文本固定，sqlite3 的语句缓存会复用同一预编译语句
+STAGE1_SQL = 'SELECT formula_id FROM formula_index WHERE h_latex = ? LIMIT ?'
+# 只读评测：加大页缓存并启用 mmap（约 200MB 缓存 / 1GB 映射），临时结构放内存
+SQLITE_PRAGMAS = (
+    "PRAGMA cache_size=-200000;"
+    "PRAGMA mmap_size=1073741824;"
+    "PRAGMA temp_store=MEMORY;"
+)
+# 评测循环的并发线程数：Stage 1 (SQLite) 与 FAISS 检索均释放 GIL
+EVAL_THREADS = os.cpu_count() or 1
+
 # Stage 1 候选集大小（可调节实验参数）
 STAGE1_TOP_K = 10000
 # 最终返回结果数
 FINAL_TOP_K = 1000
 
-# =========================== 统一清洗函数 ===========================
-def clean_latex(latex_str):
-    if not latex_str: 
-        return ""
-    latex_str = re.sub(r'\$\$?|\\\[|\\\]', '', latex_str)
-    latex_str = re.sub(r'\\dfrac|\\tfrac', r'\\frac', latex_str)
-    latex_str = re.sub(r'\\left|\\right', '', latex_str)
-    latex_str = re.sub(r'\s+', ' ', latex_str.strip())
-    return latex_str.lower()
+def _as_int_id(fid):
+    """规范十进制整数形式的 formula_id（无前导零）转为 int，其余返回 None"""
+    s = str(fid)
+    if s.isdigit() and (s[0] != '0' or s == '0'):
+        return int(s)
+    return None
 
 # =========================== 级联检索引擎 ===========================
 class CascadedRetriever:
@@ -46,87 +71,245 @@ class CascadedRetriever:
         
         # Stage 1: 哈希检索
         print(f"   [Stage 1] 加载哈希数据库...")
-        self.conn = sqlite3.connect(DB_PATH)
+        # 评测只读数据库，不在此修改库结构；h_latex 索引由 retrieval/indexer.py 建库时创建
+        self.conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        has_index = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_latex'"
+        ).fetchone()
+        if has_index is None:
+            self.conn.close()
+            raise RuntimeError(
+                f"{DB_PATH} 缺少 h_latex 索引 idx_latex，请先用 retrieval/indexer.py 建库"
+            )
+        # 查询走每线程一个只读连接（见 _stage1_cursor），多个读者互不阻塞
+        self._local = threading.local()
+        self._reader_conns = []
+        self._reader_lock = threading.Lock()
         self.hash_gen = DualHashGenerator()
+        # 查询哈希按文本缓存：重复出现的查询公式（以及重复评测）不再重新清洗、哈希
+        self._latex_hash = lru_cache(maxsize=200000)(self.hash_gen.generate_latex_hash)
         
         # Stage 2: 向量检索
         print(f"   [Stage 2] 加载向量模型与索引...")
         self.model = SentenceTransformer(MODEL_NAME, device=DEVICE)
+        if USE_FP16 and DEVICE == "cuda":
+            self.model.half()
         self.index = faiss.read_index(INDEX_PATH)
+        # GPU 索引不是线程安全的，多线程评测时其检索需串行
+        self._search_on_gpu = False
+        self._search_lock = threading.Lock()
+        self.search_index = self._load_search_index()
         
         with open(MAPPING_PATH, 'r') as f:
             self.fids = json.load(f)
         
-        # 创建ID到索引位置的反向映射
-        self.fid_to_idx = {fid: idx for idx, fid in enumerate(self.fids)}
+        # 创建ID到索引位置的反向映射：ID 均为整数时用升序 int64 数组 + searchsorted
+        # （内存约为字典的 1/10，查找在 C 中完成），否则退回字典
+        self._build_fid_lookup()
         
         print(f"   ✅ 级联系统加载完成")
         print(f"      - 数据库: {DB_PATH}")
         print(f"      - 向量索引: {self.index.ntotal:,} 条")
+        print(f"      - 全量检索索引: {PURE_VECTOR_INDEX_PATH or INDEX_PATH} ({type(self.search_index).__name__})")
+
+    def _build_fid_lookup(self):
+        int_ids = [_as_int_id(fid) for fid in self.fids]
+        self.fid_to_idx = None
+        if int_ids and None not in int_ids:
+            fids_int = np.array(int_ids, dtype=np.int64)
+            # 稳定排序；查找取同值中的最后一个，与字典“后写覆盖”一致
+            self._fid_order = np.argsort(fids_int, kind='stable')
+            self._sorted_fids = fids_int[self._fid_order]
+        else:
+            self.fid_to_idx = {fid: idx for idx, fid in enumerate(self.fids)}
+
+    def _candidate_indices(self, stage1_ids):
+        """Stage 1 命中的 formula_id -> 向量索引下标（保持原次序，不在映射表中的跳过）"""
+        if self.fid_to_idx is not None:
+            return [
+                self.fid_to_idx[str(fid)]
+                for fid in stage1_ids
+                if str(fid) in self.fid_to_idx
+            ]
+        q = np.fromiter(
+            (i for i in map(_as_int_id, stage1_ids) if i is not None), dtype=np.int64
+        )
+        pos = np.searchsorted(self._sorted_fids, q, side='right') - 1
+        mask = (pos >= 0) & (self._sorted_fids[pos.clip(min=0)] == q)
+        return self._fid_order[pos[mask]].tolist()
+
+    def _load_search_index(self):
+        """
+        纯向量模式使用的索引：默认即精确索引，配置了近似索引时加载之。
+        有 GPU 时复制一份按分片分布到全部 GPU（CPU 端的 self.index 保留，供级联模式取回候选向量）
+        """
+        if PURE_VECTOR_INDEX_PATH is None:
+            index = self.index
+        else:
+            index = faiss.read_index(PURE_VECTOR_INDEX_PATH)
+            # 在 CPU 端设置 nprobe，复制到 GPU 时会一并带上（OPQ 等预变换包装下的 IVF 同样适用）
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.nprobe = IVF_NPROBE
+        if (USE_GPU_INDEX and DEVICE == "cuda" and hasattr(faiss, 'index_cpu_to_all_gpus')
+                and faiss.get_num_gpus() > 0):
+            co = faiss.GpuMultipleClonerOptions()
+            co.shard = True
+            co.useFloat16 = GPU_INDEX_FP16
+            index = faiss.index_cpu_to_all_gpus(index, co)
+            self._search_on_gpu = True
+        return index
+
+    def _stage1_cursor(self):
+        """当前线程的只读 SQLite 游标，首次调用时建立连接"""
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+            conn.executescript(SQLITE_PRAGMAS)
+            with self._reader_lock:
+                self._reader_conns.append(conn)
+            cursor = self._local.cursor = conn.cursor()
+        return cursor
+
+    def encode_queries(self, latexes):
+        """批量编码查询（一次 encode 调用，避免逐条 batch=1 的 GPU 启动开销），返回 N x D float32"""
+        return self.model.encode(
+            list(latexes),
+            batch_size=256,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype('float32')
+
+    def _stage1(self, query_latex):
+        """Stage 1 哈希过滤：返回 (候选向量下标列表，无候选时为 None, 耗时)"""
+        t0 = time.time()
+        q_hash = self._latex_hash(query_latex)
+        
+        cursor = self._stage1_cursor()
+        cursor.execute(STAGE1_SQL, (q_hash, STAGE1_TOP_K))
+        stage1_ids = [row[0] for row in cursor.fetchall()]
+        elapsed = time.time() - t0
+        
+        candidate_indices = self._candidate_indices(stage1_ids) if stage1_ids else []
+        return candidate_indices or None, elapsed
+
+    def _rerank_candidates(self, query_emb, candidate_indices):
+        """级联模式的 Stage 2：只在 Stage 1 候选内做向量 Top-K"""
+        candidate_vectors = self._reconstruct_candidates(candidate_indices)
+        
+        # 向量已归一化，内积即余弦相似度；直接对缓冲区做矩阵-向量乘，不再另建索引复制一份候选
+        similarities = candidate_vectors @ query_emb[0]
+        top_indices = top_k_order(similarities, FINAL_TOP_K)
+        result_indices = [candidate_indices[i] for i in top_indices]
+        return result_indices, similarities[top_indices].tolist()
 
-    def retrieve(self, query_latex, use_cascade=True):
+    def full_search_batch(self, query_embs):
+        """
+        全量模式的 Stage 2：整库向量检索，返回 (indices, distances)，均为 N x FINAL_TOP_K。
+        多条查询一次送入，整库向量的每次读取由全部查询共用
+        """
+        if self._search_on_gpu:
+            with self._search_lock:
+                distances, indices = self.search_index.search(query_embs, FINAL_TOP_K)
+        else:
+            distances, indices = self.search_index.search(query_embs, FINAL_TOP_K)
+        return indices, distances
+
+    def _full_search(self, query_emb):
+        indices, distances = self.full_search_batch(query_emb)
+        return indices[0].tolist(), distances[0].tolist()
+
+    def _to_fids(self, result_indices):
+        return [self.fids[idx] for idx in result_indices if idx != -1]
+
+    def retrieve(self, query_latex, query_emb=None, use_cascade=True):
         """
         执行级联检索
+        query_emb: 可选的预先编码好的查询向量 (1 x D)；未提供时现场编码
         """
         timing = {}
+        candidate_indices = None
         
         if use_cascade:
-            # === Stage 1: 哈希过滤 ===
-            t0 = time.time()
-            q_hash = self.hash_gen.generate_latex_hash(query_latex)
-            
-            cursor = self.conn.cursor()
-            cursor.execute(
-                'SELECT formula_id FROM formula_index WHERE h_latex = ? LIMIT ?',
-                (q_hash, STAGE1_TOP_K)
-            )
-            stage1_ids = [row[0] for row in cursor.fetchall()]
-            timing['stage1'] = time.time() - t0
-            
-            if not stage1_ids:
-                use_cascade = False
-            else:
-                candidate_indices = [
-                    self.fid_to_idx[str(fid)] 
-                    for fid in stage1_ids 
-                    if str(fid) in self.fid_to_idx
-                ]
-                
-                if not candidate_indices:
-                    use_cascade = False
+            # === Stage 1: 哈希过滤（无候选时退回全量模式） ===
+            candidate_indices, timing['stage1'] = self._stage1(query_latex)
         
         # === Stage 2: 向量重排 ===
         t0 = time.time()
-        query_emb = self.model.encode(
-            [query_latex], 
-            normalize_embeddings=True, 
-            convert_to_numpy=True
-        ).astype('float32')
+        if query_emb is None:
+            query_emb = self.encode_queries([query_latex])
         
-        if use_cascade and 'candidate_indices' in locals():
-            # 级联模式
-            candidate_vectors = np.vstack([
-                self.index.reconstruct(idx) 
-                for idx in candidate_indices
-            ])
-            
-            similarities = np.dot(candidate_vectors, query_emb.T).flatten()
-            top_indices = np.argsort(-similarities)[:FINAL_TOP_K]
-            result_indices = [candidate_indices[i] for i in top_indices]
-            result_distances = [similarities[i] for i in top_indices]
+        if candidate_indices is not None:
+            result_indices, result_distances = self._rerank_candidates(query_emb, candidate_indices)
         else:
-            # 全量模式
-            distances, indices = self.index.search(query_emb, FINAL_TOP_K)
-            result_indices = indices[0].tolist()
-            result_distances = distances[0].tolist()
+            result_indices, result_distances = self._full_search(query_emb)
         
         timing['stage2'] = time.time() - t0
         
-        result_ids = [self.fids[idx] for idx in result_indices if idx != -1]
+        return self._to_fids(result_indices), timing, result_distances
+
+    def retrieve_both(self, query_latex, query_emb=None, full_result=None):
+        """
+        一次调用同时得到级联模式与纯向量模式的结果：{模式: (result_ids, timing, distances)}。
+        查询只编码一次、整库检索只做一次；级联模式无 Stage 1 候选时本就退回全量检索，直接复用其结果。
+        full_result: 可选的 full_search_batch 预先算好的 (indices, distances)，此时纯向量模式不再单独检索，
+                     也没有逐查询耗时（timing 为空，批量耗时只能作为吞吐另行统计）
+        """
+        if query_emb is None:
+            query_emb = self.encode_queries([query_latex])
+        
+        candidate_indices, stage1_time = self._stage1(query_latex)
+        
+        if full_result is None:
+            t0 = time.time()
+            full_indices, full_distances = self._full_search(query_emb)
+            pure = (self._to_fids(full_indices), {'stage2': time.time() - t0}, full_distances)
+        else:
+            full_indices, full_distances = full_result
+            pure = (self._to_fids(full_indices), {}, full_distances)
+        
+        if candidate_indices is None and full_result is None:
+            cascade = (pure[0], {'stage1': stage1_time, 'stage2': pure[1]['stage2']}, full_distances)
+        elif candidate_indices is None:
+            # 无候选时级联模式退回逐查询整库检索：单独计时，逐查询延迟不混入批量的均摊耗时
+            t0 = time.time()
+            result_indices, result_distances = self._full_search(query_emb)
+            cascade = (self._to_fids(result_indices),
+                       {'stage1': stage1_time, 'stage2': time.time() - t0}, result_distances)
+        else:
+            t0 = time.time()
+            result_indices, result_distances = self._rerank_candidates(query_emb, candidate_indices)
+            cascade = (self._to_fids(result_indices),
+                       {'stage1': stage1_time, 'stage2': time.time() - t0}, result_distances)
         
-        return result_ids, timing, result_distances
+        return {'cascade': cascade, 'pure_vector': pure}
+
+    def _candidate_buffer(self, n):
+        """
+        候选向量缓冲区 (n x D)：每个线程持有一块 STAGE1_TOP_K x D 的常驻缓冲区，
+        各查询复用同一内存，不再逐查询分配；评测线程之间互不覆盖
+        """
+        buf = getattr(self._local, 'cand_buf', None)
+        if buf is None or buf.shape[0] < n:
+            buf = np.empty((max(STAGE1_TOP_K, n), self.index.d), dtype='float32')
+            self._local.cand_buf = buf
+        return buf[:n]
+
+    def _reconstruct_candidates(self, candidate_indices):
+        """按下标一次性取回候选向量 (N x D)，写入本线程的常驻缓冲区；reconstruct_batch 为单次 C++ 调用"""
+        cand_arr = np.asarray(candidate_indices, dtype=np.int64)
+        vectors = self._candidate_buffer(len(cand_arr))
+        if hasattr(self.index, 'reconstruct_batch'):
+            self.index.reconstruct_batch(cand_arr, vectors)
+            return vectors
+        # 旧版 FAISS：逐条取回，同样直接写入缓冲区
+        for i, idx in enumerate(cand_arr):
+            vectors[i] = self.index.reconstruct(int(idx))
+        return vectors
 
     def __del__(self):
+        for conn in getattr(self, '_reader_conns', []):
+            conn.close()
         if hasattr(self, 'conn'):
             self.conn.close()
 
@@ -163,26 +346,60 @@ def run_cascaded_evaluation():
     print(f"   Stage 1 候选: {STAGE1_TOP_K}")
     print(f"   最终返回: {FINAL_TOP_K}")
     
-    for topic_id, query_latex in tqdm(list(queries.items()), desc="Evaluating"):
+    # 全部查询一次性批量编码，两种模式共用同一查询向量（下方 Stage 2 计时不再含编码）
+    t0 = time.time()
+    query_embs = retriever.encode_queries(queries.values())
+    print(f"   批量编码: {(time.time() - t0) * 1000:.1f} ms")
+    
+    # 纯向量模式的整库检索一次批量完成：它给出的是吞吐（均摊到每条查询），不是逐查询延迟
+    t0 = time.time()
+    full_indices, full_distances = retriever.full_search_batch(query_embs)
+    batch_time = time.time() - t0
+    print(f"   批量整库检索: {batch_time * 1000:.1f} ms")
+    
+    def evaluate_topic(indexed_item):
+        """单个查询两种模式的 {模式: (recall, timing)}；无标注时返回 None"""
+        i, (topic_id, query_latex) = indexed_item
         gt_docs = set(str(x) for x in relevance.get(topic_id, {}).keys())
         if not gt_docs:
-            continue
+            return None
+        query_emb = query_embs[i:i + 1]
+        full_result = (full_indices[i].tolist(), full_distances[i].tolist())
+        outcome = {}
         
-        # 模式1: 级联检索
-        result_ids, timing, _ = retriever.retrieve(query_latex, use_cascade=True)
-        retrieved_set = set(str(x) for x in result_ids)
-        hits = len(gt_docs.intersection(retrieved_set))
-        recall = hits / len(gt_docs)
-        results['cascade']['recalls'].append(recall)
-        results['cascade']['times'].append(timing)
-        
-        # 模式2: 纯向量检索
-        result_ids, timing, _ = retriever.retrieve(query_latex, use_cascade=False)
-        retrieved_set = set(str(x) for x in result_ids)
-        hits = len(gt_docs.intersection(retrieved_set))
-        recall = hits / len(gt_docs)
-        results['pure_vector']['recalls'].append(recall)
-        results['pure_vector']['times'].append(timing)
+        # 模式1: 级联检索；模式2: 纯向量检索（一次调用，共用查询向量与整库检索结果）
+        for mode, (result_ids, timing, _) in retriever.retrieve_both(query_latex, query_emb, full_result).items():
+            retrieved_set = set(str(x) for x in result_ids)
+            hits = len(gt_docs.intersection(retrieved_set))
+            outcome[mode] = (hits / len(gt_docs), timing)
+        return outcome
+    
+    # 多线程并发评测（每线程独立的只读 SQLite 连接），按查询原次序汇总
+    items = list(queries.items())
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=EVAL_THREADS) as executor:
+        outcomes = list(tqdm(
+            executor.map(evaluate_topic, enumerate(items)),
+            total=len(items), desc="Evaluating"
+        ))
+    loop_time = time.time() - t0
+    
+    for outcome in outcomes:
+        if outcome is None:
+            continue
+        for mode, (recall, timing) in outcome.items():
+            results[mode]['recalls'].append(recall)
+            results[mode]['times'].append(timing)
+    
+    # 两种口径分开统计：
+    #   延迟 = 逐查询计时的均值（仅级联模式；纯向量模式的整库检索是批量执行的，没有逐查询耗时）
+    #   吞吐 = 总耗时 / 查询数（级联模式为并发评测循环的墙钟时间，纯向量模式为批量检索时间）
+    n_evaluated = max(len(results['cascade']['recalls']), 1)
+    throughput = {'cascade': loop_time / n_evaluated, 'pure_vector': batch_time / max(len(queries), 1)}
+    
+    def mean_latency(times):
+        times = [t for t in times if t]
+        return np.mean([sum(t.values()) for t in times]) * 1000 if times else None
     
     # 输出结果
     print("\n" + "="*70)
@@ -191,12 +408,16 @@ def run_cascaded_evaluation():
     
     for mode_name, mode_data in results.items():
         avg_recall = np.mean(mode_data['recalls']) * 100
-        avg_time = np.mean([sum(t.values()) for t in mode_data['times']]) * 1000
+        avg_latency = mean_latency(mode_data['times'])
         
         mode_title = '级联模式 (Stage 1 + 2)' if mode_name == 'cascade' else '纯向量模式 (Stage 2 Only)'
         print(f"\n{mode_title}")
         print(f"   Mean Recall@{FINAL_TOP_K}: {avg_recall:.2f}%")
-        print(f"   平均查询时间: {avg_time:.1f} ms")
+        if avg_latency is not None:
+            print(f"   平均查询延迟 (逐查询计时): {avg_latency:.1f} ms")
+        else:
+            print(f"   平均查询延迟: 未逐查询计时（整库检索为批量执行）")
+        print(f"   吞吐 (总耗时均摊): {throughput[mode_name] * 1000:.1f} ms/查询")
         
         if mode_name == 'cascade' and mode_data['times']:
             stage1_time = np.mean([t.get('stage1', 0) for t in mode_data['times']]) * 1000
@@ -215,7 +436,8 @@ def run_cascaded_evaluation():
             mode: {
                 'mean_recall': np.mean(data['recalls']) * 100,
                 'std_recall': np.std(data['recalls']) * 100,
-                'mean_time_ms': np.mean([sum(t.values()) for t in data['times']]) * 1000,
+                'mean_latency_ms': mean_latency(data['times']),
+                'throughput_ms_per_query': throughput[mode] * 1000,
                 'num_queries': len(data['recalls'])
             }
             for mode, data in results.items()
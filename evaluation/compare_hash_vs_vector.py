@@ -3,9 +3,10 @@ import sqlite3
 import torch
 import faiss
 import numpy as np
-import re
 from sentence_transformers import SentenceTransformer
 from retrieval.approach0_hash import DualHashGenerator
+from utils.packed_corpus import load_corpus
+from utils.latex_clean import clean_latex as _clean_latex
 from pathlib import Path
 
 # ==================== 配置 ====================
@@ -16,12 +17,12 @@ FORMULA_JSON = "data/processed/formulas.json"
 LABEL_PATH = "data/processed/relevance_labels.json"
 QUERY_PATH = "data/processed/queries_full.json"
 MODEL_NAME = 'math-similarity/Bert-MLM_arXiv-MP-class_zbMath'
+# GPU 上以 FP16 推理（启用 Tensor Core）；编码结果统一转回 float32 再检索 / 求内积
+USE_FP16 = True
 
+# 仅去除定界符与多余空白（不做命令规范化与小写化）
 def clean_latex(latex):
-    if not latex: return ""
-    latex = re.sub(r'\$\$?|\\\[|\\\]', '', latex)
-    latex = re.sub(r'\s+', ' ', latex)
-    return latex.strip()
+    return _clean_latex(latex, normalize_commands=False, lower=False)
 
 class DualPathAnalyzer:
     def __init__(self):
@@ -31,6 +32,8 @@ class DualPathAnalyzer:
         self.hash_gen = DualHashGenerator()
         
         self.model = SentenceTransformer(MODEL_NAME, device="cuda")
+        if USE_FP16:
+            self.model.half()
         self.index = faiss.read_index(VECTOR_INDEX_PATH)
         with open(MAPPING_PATH, 'r') as f:
             self.fids = json.load(f)
@@ -39,23 +42,29 @@ class DualPathAnalyzer:
             self.relevance = json.load(f)
         with open(QUERY_PATH, 'r') as f:
             self.queries = json.load(f)
-        with open(FORMULA_JSON, 'r') as f:
-            self.corpus = json.load(f)
+        # 有 scripts/pack_corpus.py 的打包文件时内存映射读取，不再整体解析 JSON
+        self.corpus = load_corpus(FORMULA_JSON)
 
     def eval_stage1_hash(self):
         """评测 Stage 1: 结构化哈希召回率"""
         print("\n--- [Stage 1: 哈希召回评测] ---")
         recall_list = []
-        for topic_id, query_latex in self.queries.items():
-            gt_ids = set(self.relevance.get(topic_id, {}).keys())
-            if not gt_ids: continue
-            
-            # 生成查询 DNA
-            dna = self.hash_gen.generate(query_latex)
+        topics = [(tid, q) for tid, q in self.queries.items() if self.relevance.get(tid)]
+        
+        # 生成查询 DNA：相同的查询文本只计算一次
+        dna_by_latex = {q: self.hash_gen.generate(q) for q in {q for _, q in topics}}
+        # 同一 DNA 的数据库结果也只查询一次
+        retrieved_by_dna = {}
+        
+        for topic_id, query_latex in topics:
+            gt_ids = set(self.relevance[topic_id].keys())
+            dna = dna_by_latex[query_latex]
             
             # 从数据库中寻找 DNA 完全一致的公式
-            self.cursor.execute("SELECT formula_id FROM formulas WHERE dna = ?", (dna,))
-            retrieved_ids = {str(row[0]) for row in self.cursor.fetchall()}
+            if dna not in retrieved_by_dna:
+                self.cursor.execute("SELECT formula_id FROM formulas WHERE dna = ?", (dna,))
+                retrieved_by_dna[dna] = {str(row[0]) for row in self.cursor.fetchall()}
+            retrieved_ids = retrieved_by_dna[dna]
             
             hits = len(gt_ids.intersection(retrieved_ids))
             recall = hits / len(gt_ids)
@@ -68,16 +77,23 @@ class DualPathAnalyzer:
         print("\n--- [向量检索失败深度分析] ---")
         
         # 寻找一个标准答案在库中，但向量 Top-1000 没搜到的例子
-        for topic_id, query_latex in self.queries.items():
-            gt_dict = self.relevance.get(topic_id, {})
-            if not gt_dict: continue
-            
-            # 1. 编码查询向量
-            q_emb = self.model.encode([clean_latex(query_latex)], normalize_embeddings=True)[0]
-            
-            # 2. 执行 Top-1000 检索
-            distances, indices = self.index.search(np.array([q_emb]).astype('float32'), 1000)
-            retrieved_fids = {str(self.fids[idx]) for idx in indices[0] if idx != -1}
+        topics = [(tid, q) for tid, q in self.queries.items() if self.relevance.get(tid)]
+        if not topics:
+            return
+        
+        # 1. 全部查询一次性批量编码（避免逐条 batch=1 的 GPU 调用）
+        q_embs = self.model.encode(
+            [clean_latex(q) for _, q in topics], batch_size=256,
+            normalize_embeddings=True, convert_to_numpy=True
+        ).astype('float32')
+        
+        # 2. N x D 矩阵一次送入 FAISS，执行 Top-1000 检索
+        _, all_indices = self.index.search(q_embs, 1000)
+        
+        for i, (topic_id, query_latex) in enumerate(topics):
+            gt_dict = self.relevance[topic_id]
+            q_emb = q_embs[i]
+            retrieved_fids = {str(self.fids[idx]) for idx in all_indices[i] if idx != -1}
             
             # 3. 寻找一个“遗珠”：在库里（corpus）但不在检索结果里（retrieved_fids）的标准答案
             missed_gt_id = None
@@ -92,7 +108,7 @@ class DualPathAnalyzer:
                 
                 # 获取该遗珠的 LaTeX 并计算向量距离
                 gt_latex = self.corpus[missed_gt_id]['latex_norm']
-                gt_emb = self.model.encode([clean_latex(gt_latex)], normalize_embeddings=True)[0]
+                gt_emb = self.model.encode([clean_latex(gt_latex)], normalize_embeddings=True)[0].astype('float32')
                 
                 # 计算余弦相似度
                 # 因为向量已归一化，点积即余弦相似度
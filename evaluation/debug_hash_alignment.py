@@ -1,17 +1,13 @@
 import json
-import re
 from pathlib import Path
 from retrieval.approach0_hash import DualHashGenerator
+from utils.packed_corpus import load_corpus
+from utils.latex_clean import clean_latex as _clean_latex
 
 # =========================== 必须与 prepare 脚本完全一致的清洗函数 ===========================
+# 按照最新的建议，不使用 .lower()
 def clean_latex(latex_str):
-    if not latex_str: return ""
-    latex_str = re.sub(r'\$\$?|\\\[|\\\]', '', latex_str)
-    latex_str = re.sub(r'\\dfrac|\\tfrac', r'\\frac', latex_str)
-    latex_str = re.sub(r'\\left|\\right', '', latex_str)
-    latex_str = re.sub(r'\s+', ' ', latex_str.strip())
-    # 按照最新的建议，不使用 .lower()
-    return latex_str
+    return _clean_latex(latex_str, lower=False)
 
 def debug_alignment():
     print("🧪 --- 启动 Hash 对齐性深度诊断 --- 🧪\n")
@@ -20,8 +16,8 @@ def debug_alignment():
     try:
         with open("data/processed/queries_full.json", 'r') as f:
             queries = json.load(f)
-        with open("data/processed/formulas.json", 'r') as f:
-            corpus = json.load(f)
+        # 有 scripts/pack_corpus.py 的打包文件时内存映射读取，不再整体解析 JSON
+        corpus = load_corpus("data/processed/formulas.json")
         with open("data/processed/relevance_labels.json", 'r') as f:
             relevance = json.load(f)
     except FileNotFoundError as e:
@@ -1,5 +1,7 @@
 import json
 import csv
+import os
+import multiprocessing as mp
 import numpy as np
 from pathlib import Path
 from tqdm import tqdm
@@ -9,6 +11,15 @@ from collections import Counter
 FORMULAS_JSON = "data/processed/formulas.json"
 QUERIES_JSON = "data/processed/queries_full.json"
 LATEX_DIR = "data/arqmath3/latex_representation_v3"
+NUM_WORKERS = os.cpu_count() or 1
+
+def _count_file(path):
+    """单个 TSV 分片的 Visual ID 计数（子进程中执行）"""
+    with open(path, 'r', encoding='utf-8') as fin:
+        reader = csv.reader(fin, delimiter='\t')
+        next(reader, None)
+        # Counter 直接消费生成器，计数循环在 C 中完成
+        return Counter(row[6].strip() for row in reader if len(row) > 6)
 
 def get_visual_id_frequencies():
     """统计每个 Visual ID 在 2826 万原始实例中出现的频率"""
@@ -16,13 +27,11 @@ def get_visual_id_frequencies():
     freq_map = Counter()
     tsv_files = sorted(list(Path(LATEX_DIR).glob("*.tsv")))
     
-    for f in tqdm(tsv_files, desc="Scanning for frequencies"):
-        with open(f, 'r', encoding='utf-8') as fin:
-            reader = csv.reader(fin, delimiter='\t')
-            next(reader, None)
-            for row in reader:
-                if len(row) > 6:
-                    freq_map[row[6].strip()] += 1
+    # 各分片相互独立：多进程分别计数，主进程合并
+    with mp.Pool(max(1, min(NUM_WORKERS, len(tsv_files)))) as pool:
+        for partial in tqdm(pool.imap_unordered(_count_file, tsv_files),
+                            total=len(tsv_files), desc="Scanning for frequencies"):
+            freq_map.update(partial)
     return freq_map
 
 def analyze_diversity():
@@ -38,8 +38,8 @@ def analyze_errors():
         gt_ids = set(str(vid) for vid in gt_dict.keys())
         results = evaluator.search_single(query_latex)
         
-        hits = gt_ids.intersection(set(results))
-        if len(hits) == 0:
+        # 只需判断有无命中：isdisjoint 直接遍历结果列表，遇到首个命中即返回，不再构造集合
+        if gt_ids.isdisjoint(results):
             failed_cases.append({
                 "qid": qid,
                 "query": query_latex,
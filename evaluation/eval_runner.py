@@ -9,13 +9,117 @@ Key fixes:
 4. ✅ Progress bar integration
 """
 
+import os
 import numpy as np
 from tqdm import tqdm
 import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+# 可选：numba JIT 编译单查询指标内核，未安装时回退到 NumPy 向量化实现
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# log2(i + 2) 折损表，按需扩容；按名次直接取值，不再逐个调用 np.log2
+_log2_table = np.log2(np.arange(2, 1002, dtype=np.float64))
+
+
+def _log2_discounts(n):
+    global _log2_table
+    if _log2_table.size < n:
+        _log2_table = np.log2(np.arange(2, n + 2, dtype=np.float64))
+    return _log2_table
+
+
+def _rank_metrics_numpy(pred_rels, pred_in_gt):
+    """
+    单查询指标内核：pred_rels / pred_in_gt 为检索结果逐位的相关性与是否在标注中。
+    返回 (命中数, AP 累加和)
+    """
+    rel_pos = np.flatnonzero(pred_rels > 0)
+    ap = float(np.sum(np.arange(1, rel_pos.size + 1) / (rel_pos + 1)))
+    return int(np.count_nonzero(pred_in_gt)), ap
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _rank_metrics(pred_rels, pred_in_gt):
+        hits = 0
+        relevant_found = 0
+        ap = 0.0
+        for i in range(pred_rels.size):
+            if pred_in_gt[i]:
+                hits += 1
+            if pred_rels[i] > 0:
+                relevant_found += 1
+                ap += relevant_found / (i + 1)
+        return hits, ap
+else:
+    _rank_metrics = _rank_metrics_numpy
+
+
+def _pad_rows(rows, width):
+    """变长一维数组补零堆叠为 (len(rows), width) 矩阵"""
+    out = np.zeros((len(rows), width))
+    for i, row in enumerate(rows):
+        out[i, :row.size] = row
+    return out
+
+
+def _batch_ndcg(pred_rels_list, ideal_rels_list):
+    """
+    全部查询的 nDCG 一次向量化计算：逐位相关性与理想相关性各自补零成 (Q, K) 矩阵
+    （补零位增益为 0），除以同一折损向量后按行求和
+    """
+    if not pred_rels_list:
+        return np.zeros(0)
+    k = max(max(r.size for r in pred_rels_list), 1)
+    log2_table = _log2_discounts(k)[:k]
+    dcg = ((2.0 ** _pad_rows(pred_rels_list, k) - 1) / log2_table).sum(axis=1)
+    idcg = ((2.0 ** _pad_rows(ideal_rels_list, k) - 1) / log2_table).sum(axis=1)
+    return np.where(idcg > 0, dcg / np.where(idcg > 0, idcg, 1.0), 0.0)
+
+
+def hit_matrix(results_list, gt_list):
+    """
+    (Nq, K) 命中矩阵：results_list[i] 为第 i 个查询的检索 ID 列表（变长，按 K 补齐为未命中），
+    gt_list[i] 为其标注 ID 集合。标注 ID 先映射为紧凑整数，(查询, ID) 对编码为单个 int64，
+    全部查询一次 np.isin 完成判定
+    """
+    id2int = {}
+    for gt in gt_list:
+        for doc_id in gt:
+            id2int.setdefault(doc_id, len(id2int))
+    n_ids = max(len(id2int), 1)
+    
+    k = max((len(r) for r in results_list), default=0)
+    results_int = np.full((len(results_list), k), -1, dtype=np.int64)
+    for qi, results in enumerate(results_list):
+        results_int[qi, :len(results)] = np.fromiter(
+            (id2int.get(doc_id, -1) for doc_id in results), dtype=np.int64, count=len(results))
+    
+    row_base = np.arange(len(results_list), dtype=np.int64)[:, None] * n_ids
+    codes = np.where(results_int >= 0, row_base + results_int, -1)
+    gt_codes = np.fromiter((qi * n_ids + id2int[doc_id] for qi, gt in enumerate(gt_list) for doc_id in gt),
+                           dtype=np.int64)
+    return np.isin(codes, gt_codes)
+
+
+def recall_and_mrr(hit_mat, gt_sizes):
+    """
+    由命中矩阵逐查询计算 (Recall, MRR) 两个数组；要求每个查询的检索结果内 ID 不重复
+    """
+    hits = hit_mat.sum(axis=1)
+    recalls = hits / np.asarray(gt_sizes, dtype=np.float64)
+    first_hit = hit_mat.argmax(axis=1) if hit_mat.shape[1] else np.zeros(len(hits), dtype=np.int64)
+    mrrs = np.where(hits > 0, 1.0 / (first_hit + 1), 0.0)
+    return recalls, mrrs
+
 
 def load_qrel_labels(qrel_path):
     """
@@ -74,8 +178,10 @@ def calculate_metrics(all_results, labels):
         Dict with averaged metrics
     """
     maps = []
-    ndcgs = []
     recalls = []
+    # nDCG 所需的逐查询相关性数组，循环结束后统一向量化计算
+    pred_rels_list = []
+    ideal_rels_list = []
     
     # 统计未找到标签的查询
     missing_labels = 0
@@ -90,39 +196,28 @@ def calculate_metrics(all_results, labels):
         
         # 提取检索到的 ID 列表
         pred_ids = [c['formula_id'] for c in candidates]
+        k = len(pred_ids)
         
-        # --- 1. Recall@K (二值化版本) ---
-        hits = sum(1 for fid in pred_ids if fid in gt_dict)
-        recalls.append(1 if hits > 0 else 0)
+        # 字典查表只做一次，得到逐位的相关性数组
+        pred_rels = np.fromiter((gt_dict.get(fid, 0) for fid in pred_ids), dtype=np.float64, count=k)
+        pred_in_gt = np.fromiter((fid in gt_dict for fid in pred_ids), dtype=np.bool_, count=k)
+        # ✅ 修正 IDCG 计算：使用固定的 K，取 Top-K 个最相关的
+        ideal_rels = np.array(sorted(gt_dict.values(), reverse=True)[:k], dtype=np.float64)
         
-        # --- 2. Average Precision (AP) ---
-        ap = 0.0
-        relevant_found = 0
+        hits, ap = _rank_metrics(pred_rels, pred_in_gt)
         
-        for i, fid in enumerate(pred_ids):
-            if fid in gt_dict and gt_dict[fid] > 0:  # 考虑相关性分数
-                relevant_found += 1
-                ap += relevant_found / (i + 1)
+        # --- 1. Recall@K (二值化版本) ---
+        recalls.append(1 if hits > 0 else 0)
         
+        # --- 2. Average Precision (AP，只计相关性分数 > 0 的命中) ---
         total_relevant = sum(1 for score in gt_dict.values() if score > 0)
         maps.append(ap / max(1, total_relevant))
         
-        # --- 3. nDCG@K ---
-        # 计算 DCG (Discounted Cumulative Gain)
-        dcg = 0.0
-        for i, fid in enumerate(pred_ids):
-            rel = gt_dict.get(fid, 0)
-            dcg += (2**rel - 1) / np.log2(i + 2)
-        
-        # ✅ 修正 IDCG 计算：使用固定的 K
-        k = len(pred_ids)
-        ideal_rels = sorted(gt_dict.values(), reverse=True)[:k]  # ← 修正：取 Top-K 个最相关的
-        
-        idcg = 0.0
-        for i, rel in enumerate(ideal_rels):
-            idcg += (2**rel - 1) / np.log2(i + 2)
-        
-        ndcgs.append(dcg / idcg if idcg > 0 else 0)
+        # --- 3. nDCG@K（见 _batch_ndcg） ---
+        pred_rels_list.append(pred_rels)
+        ideal_rels_list.append(ideal_rels)
+    
+    ndcgs = _batch_ndcg(pred_rels_list, ideal_rels_list)
     
     # 日志输出
     if missing_labels > 0:
@@ -133,12 +228,53 @@ def calculate_metrics(all_results, labels):
     return {
         "Recall@K": float(np.mean(recalls)) if recalls else 0.0,
         "MAP": float(np.mean(maps)) if maps else 0.0,
-        "nDCG@K": float(np.mean(ndcgs)) if ndcgs else 0.0,
+        "nDCG@K": float(np.mean(ndcgs)) if ndcgs.size else 0.0,
         "num_evaluated_queries": len(recalls)
     }
 
 
-def evaluate(pipeline, queries, labels):
+# 子进程内的检索管线（每个进程只构建一次）
+_worker_pipeline = None
+
+
+def _init_pipeline(pipeline_factory):
+    global _worker_pipeline
+    _worker_pipeline = pipeline_factory()
+
+
+def _search_chunk(queries):
+    """子进程中检索一组查询，返回 ({query_id: results}, 失败数)"""
+    results = {}
+    failed = 0
+    for query in queries:
+        qid = query["query_id"]
+        try:
+            results[qid] = _worker_pipeline.search(query)
+        except Exception as e:
+            logger.error(f"❌ Error processing query {qid}: {e}")
+            results[qid] = []
+            failed += 1
+    return results, failed
+
+
+def _evaluate_parallel(queries, n_jobs, pipeline_factory):
+    """查询切块后分发到多个进程，按原次序合并结果"""
+    n_chunks = min(len(queries), n_jobs * 4)
+    chunks = [queries[i::n_chunks] for i in range(n_chunks)]
+    # 交错切块使各块负载均衡；合并后再按原查询次序重排
+    parts = {}
+    failed_count = 0
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_pipeline,
+                             initargs=(pipeline_factory,)) as executor:
+        for results, failed in tqdm(executor.map(_search_chunk, chunks), total=n_chunks,
+                                    desc="🔎 Evaluating", unit="chunk"):
+            parts.update(results)
+            failed_count += failed
+    all_results = {q["query_id"]: parts[q["query_id"]] for q in queries}
+    return all_results, failed_count
+
+
+def evaluate(pipeline, queries, labels, n_jobs=1, pipeline_factory=None):
     """
     运行评估循环并返回指标和全量结果
     
@@ -146,10 +282,20 @@ def evaluate(pipeline, queries, labels):
         pipeline: SearchPipeline instance
         queries: List[dict] with query_id and latex
         labels: Dict[query_id, Dict[doc_id, relevance]]
+        n_jobs: 并行进程数（-1 表示 CPU 核数）。仅适用于纯 CPU 管线，GPU 管线保持默认的单进程
+        pipeline_factory: 并行时每个子进程调用一次以构建自己的管线（须可 pickle，如模块级函数）
     
     Returns:
         (metrics: dict, all_results: dict)
     """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs > 1 and pipeline_factory is not None and len(queries) > 1:
+        all_results, failed_count = _evaluate_parallel(queries, n_jobs, pipeline_factory)
+        if failed_count > 0:
+            logger.warning(f"⚠️  {failed_count}/{len(queries)} queries failed")
+        return calculate_metrics(all_results, labels), all_results
+    
     all_results = {}
     
     # 进度条初始化
@@ -141,66 +141,173 @@
 import json
 import faiss
 import numpy as np
+from functools import lru_cache
+from itertools import chain
 from tqdm import tqdm
 from retrieval.approach0_hash import DualHashGenerator, Approach0HashIndex
+from utils.embedding_cache import QueryEmbeddingCache
+from evaluation.eval_runner import hit_matrix, recall_and_mrr
+
+MODEL_NAME = 'math-similarity/Bert-MLM_arXiv-MP-class_zbMath'
+# 向量索引：精确 Flat 索引；python scripts/quantize_vector_index.py --kind sq8 生成的
+# artifacts/vector_index_full_v4_sq8.faiss（INT8 标量量化，向量次序与映射文件不变）可直接替换
+VECTOR_INDEX_PATH = "artifacts/vector_index_full_v4.faiss"
+# 换成 --kind ivfpq / opq-ivfpq 生成的 IVF 索引时，每条查询扫描的倒排列表数
+IVF_NPROBE = 32
+# GPU 上以 FP16 推理（与其余评测脚本相同的开关）；精度同时计入查询向量缓存的键，FP16 / FP32 向量不混用
+USE_FP16 = False
+
+# 可选：faiss.contrib.torch_utils 让 GPU 索引的 search 直接接受 CUDA torch.Tensor，
+# 查询向量不再经 GPU -> CPU -> GPU 往返
+try:
+    import torch
+    import faiss.contrib.torch_utils
+    TORCH_FAISS_AVAILABLE = True
+except ImportError:
+    TORCH_FAISS_AVAILABLE = False
 
 class HybridEvaluator:
     def __init__(self):
         print("📦 加载检索资源...")
         self.hash_gen = DualHashGenerator()
+        # 清洗与哈希按查询文本缓存：重复的查询公式（及 search_single 的重复调用）只计算一次
+        self.normalize = lru_cache(maxsize=100_000)(self.normalize)
+        self._hash = lru_cache(maxsize=100_000)(self.hash_gen.generate_latex_hash)
         self.h_index = Approach0HashIndex()
-        self.h_index.load("artifacts/approach0_index.pkl")
+        self.h_index.load("artifacts/approach0_index.a0idx")
         
         from sentence_transformers import SentenceTransformer
-        self.model = SentenceTransformer('math-similarity/Bert-MLM_arXiv-MP-class_zbMath', device="cuda")
-        self.v_index = faiss.read_index("artifacts/vector_index_full_v4.faiss")
+        self.model = SentenceTransformer(MODEL_NAME, device="cuda")
+        if USE_FP16:
+            self.model.half()
+        # 查询向量的磁盘缓存：再次运行时未变化的查询不再经过编码器
+        self.emb_cache = QueryEmbeddingCache(MODEL_NAME, "fp16" if USE_FP16 else "fp32")
+        self.v_index = faiss.read_index(VECTOR_INDEX_PATH)
+        # IVF 索引（含 OPQ 预变换包装）在 CPU 端设置 nprobe，复制到 GPU 时会一并带上
+        ivf = faiss.try_extract_index_ivf(self.v_index)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+        # 有 GPU 版 FAISS 时把向量索引按分片分布到全部 GPU（与编码模型同在 CUDA 上），批量检索整体在 GPU 完成
+        if hasattr(faiss, 'index_cpu_to_all_gpus') and faiss.get_num_gpus() > 0:
+            co = faiss.GpuMultipleClonerOptions()
+            co.shard = True
+            self.v_index = faiss.index_cpu_to_all_gpus(self.v_index, co)
+        # 单卡时得到的是普通 GPU 索引（有 getDevice），可直接检索 CUDA 张量；多卡分片索引仍走 numpy
+        self._zero_copy = TORCH_FAISS_AVAILABLE and hasattr(self.v_index, 'getDevice')
+        # 向量下标 -> 字符串 ID 只转换一次；object 数组可按整行 FAISS 下标直接取值
         with open("artifacts/vector_id_mapping_v4.json", 'r') as f:
-            self.v_mapping = json.load(f)
+            self.v_mapping = np.array([str(fid) for fid in json.load(f)], dtype=object)
             
         with open("data/processed/queries_full.json", 'r') as f:
             self.queries = json.load(f)
         with open("data/processed/relevance_labels.json", 'r') as f:
             self.relevance = json.load(f)
+        
+        # 评测用的并行数组（只保留有标注的查询）：qids / latex / gt 按下标一一对应
+        labelled = [(qid, q_latex, frozenset(str(k) for k in self.relevance.get(qid, {})))
+                    for qid, q_latex in self.queries.items()]
+        labelled = [item for item in labelled if item[2]]
+        self.qids = np.array([qid for qid, _, _ in labelled], dtype=object)
+        self.latex = np.array([q_latex for _, q_latex, _ in labelled], dtype=object)
+        self.gt = [gt for _, _, gt in labelled]
 
-    def search_single(self, query_latex):
+    def normalize(self, query_latex):
         # A. 预处理 (适配多返回值)
         res = self.hash_gen.clean_latex(query_latex)
-        norm_latex = res[0] if isinstance(res, tuple) else res
+        return res[0] if isinstance(res, tuple) else res
+
+    def _encode(self, latexes, batch_size):
+        if self._zero_copy:
+            # 编码结果留在 GPU 上（FP32 张量），直接送入 GPU 索引
+            return self.model.encode(
+                latexes, batch_size=batch_size, normalize_embeddings=True,
+                convert_to_tensor=True, show_progress_bar=False
+            )
+        return self.model.encode(
+            latexes, batch_size=batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        ).astype('float32')
+
+    def _search(self, q_embs, k=1000):
+        """FAISS 检索，返回 numpy 下标矩阵；CUDA 张量的结果只在此处拷回主机一次"""
+        if not TORCH_FAISS_AVAILABLE:
+            _, indices = self.v_index.search(q_embs, k)
+            return indices
+        # 检索期间把 PyTorch 的 intra-op 线程降为 1，避免与 FAISS 的 OpenMP 线程争抢核心
+        torch_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        try:
+            _, indices = self.v_index.search(q_embs, k)
+        finally:
+            torch.set_num_threads(torch_threads)
+        return indices.cpu().numpy() if torch.is_tensor(indices) else indices
+
+    def _to_numpy(self, embs):
+        return embs.cpu().numpy() if TORCH_FAISS_AVAILABLE and torch.is_tensor(embs) else embs
+
+    def encode_batch(self, norm_latexes, batch_size=64, show_progress_bar=False):
+        """
+        多条查询按 token 长度分桶编码，返回原次序的 N x D float32（可直接检索时为 CUDA 张量）。
+        SentenceTransformer 内部按字符数排序，与 token 数并不一致（LaTeX 命令一个词元可占多个字符）；
+        这里按 token 数排序后每 batch_size 条一桶，桶内长度相近，补齐的 PAD 最少
+        """
+        latexes = list(norm_latexes)
+        if len(latexes) <= batch_size:
+            return self._encode(latexes, batch_size)
+        
+        lengths = [len(ids) for ids in self.model.tokenizer(latexes, add_special_tokens=False)['input_ids']]
+        order = np.argsort(lengths, kind='stable')
+        buckets = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        parts = [self._encode([latexes[i] for i in bucket], batch_size)
+                 for bucket in tqdm(buckets, desc="Encoding", disable=not show_progress_bar)]
+        
+        # 拼接后按逆排列还原为原次序
+        inv = np.argsort(order)
+        if self._zero_copy:
+            return torch.cat(parts)[torch.as_tensor(inv, device=parts[0].device)]
+        return np.concatenate(parts)[inv]
+
+    def merge_results(self, h_res, v_row):
+        """哈希路结果在前、向量路 (一行 FAISS 下标) 在后，去重后取前 1000"""
+        v_row = np.asarray(v_row)
+        v_res = self.v_mapping[v_row[v_row != -1]].tolist()
+        # dict.fromkeys 保序去重（C 实现），chain 免去拼接出的中间列表
+        return list(dict.fromkeys(chain(h_res, v_res)))[:1000]
+
+    def search_single(self, query_latex):
+        norm_latex = self.normalize(query_latex)
         
         # B. 哈希路
-        h_val = self.hash_gen.generate_latex_hash(norm_latex)
-        h_res = self.h_index.search(h_val)
+        h_res = self.h_index.search(self._hash(norm_latex))
         
         # C. 向量路
-        q_emb = self.model.encode([norm_latex], normalize_embeddings=True, convert_to_numpy=True)
-        _, v_indices = self.v_index.search(q_emb.astype('float32'), 1000)
-        v_res = [str(self.v_mapping[idx]) for idx in v_indices[0] if idx != -1]
+        v_indices = self._search(self.encode_batch([norm_latex]))
         
         # D. 合并
-        combined = []
-        seen = set()
-        for vid in h_res + v_res:
-            if vid not in seen:
-                combined.append(vid)
-                seen.add(vid)
-        return combined[:1000]
+        return self.merge_results(h_res, v_indices[0])
 
     def run(self):
-        recalls, mrr_scores = [], []
-        for qid, q_latex in tqdm(self.queries.items(), desc="Evaluating"):
-            gt = set(str(k) for k in self.relevance.get(qid, {}).keys())
-            if not gt: continue
-            
-            results = self.search_single(q_latex)
-            hits = gt.intersection(set(results))
-            recalls.append(len(hits)/len(gt))
-            
-            mrr = 0
-            for i, r in enumerate(results):
-                if r in gt:
-                    mrr = 1/(i+1)
-                    break
-            mrr_scores.append(mrr)
+        # 只评测有标注的查询（见 __init__ 中的并行数组）；先统一预处理，再一次批量编码、一次批量 FAISS 检索
+        if not self.gt:
+            print("⚠️ 没有带标注的查询")
+            return
+        norms = [self.normalize(q_latex) for q_latex in self.latex]
+        
+        all_embs = self.emb_cache.encode(
+            norms,
+            lambda misses: self._to_numpy(self.encode_batch(misses, show_progress_bar=True))
+        )
+        all_indices = self._search(all_embs)
+        
+        # 哈希经缓存生成（与 search_single 共用）；逐查询只剩字典查找与结果合并（均在 GIL 内，线程池并不能加速）
+        h_vals = [self._hash(norm) for norm in norms]
+        all_results = [
+            self.merge_results(self.h_index.search(h_val), v_row)
+            for h_val, v_row in tqdm(zip(h_vals, all_indices), total=len(norms), desc="Evaluating")
+        ]
+        
+        # 指标在 (Nq, K) 命中矩阵上一次计算（merge_results 已去重）
+        recalls, mrr_scores = recall_and_mrr(hit_matrix(all_results, self.gt), [len(gt) for gt in self.gt])
             
         print(f"\n🏆 Mean Recall@1000: {np.mean(recalls)*100:.2f}%")
         print(f"🏆 Mean MRR@1000:    {np.mean(mrr_scores):.4f}")
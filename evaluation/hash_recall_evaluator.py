@@ -1,9 +1,13 @@
 import json
 import sqlite3
-import re
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 from tqdm import tqdm
 from retrieval.approach0_hash import DualHashGenerator
+from utils.latex_clean import clean_latex
+from utils.json_io import load_json
+from utils.packed_corpus import load_corpus
 
 # ==================== 配置 ====================
 DB_PATH = "artifacts/formula_index.db"
@@ -12,16 +16,10 @@ QUERY_PATH = "data/processed/queries_full.json"
 FORMULAS_PATH = "data/processed/formulas.json"
 TOP_K = 10000  # Stage 1通常召回更多候选
 
-# =========================== 统一的LaTeX清洗函数 ===========================
-def clean_latex(latex_str):
-    """必须与其他脚本保持一致"""
-    if not latex_str: 
-        return ""
-    latex_str = re.sub(r'\$\$?|\\\[|\\\]', '', latex_str)
-    latex_str = re.sub(r'\\dfrac|\\tfrac', r'\\frac', latex_str)
-    latex_str = re.sub(r'\\left|\\right', '', latex_str)
-    latex_str = re.sub(r'\s+', ' ', latex_str.strip())
-    return latex_str.lower()
+# 查询清洗按文本缓存：重复出现的查询公式只清洗一次
+clean_latex = lru_cache(maxsize=100_000)(clean_latex)
+# SQLite 单条语句的占位符上限为 999，批量 IN 查询按此分块
+SQL_IN_CHUNK = 500
 
 # =========================== Stage 1 评测引擎 ===========================
 class HashEvaluator:
@@ -31,15 +29,16 @@ class HashEvaluator:
         # 加载数据库
         self.conn = sqlite3.connect(DB_PATH)
         self.hash_gen = DualHashGenerator()
+        # 查询哈希按文本缓存：预加载与逐条检索共用，重复查询不再重新计算
+        self._hash = lru_cache(maxsize=100_000)(self.hash_gen.generate_latex_hash)
         
         # 加载公式元数据（用于提取DNA）
+        # 有 scripts/pack_corpus.py 的打包文件时内存映射读取，否则用 orjson 解析 JSON
         print(f"   - 正在加载公式元数据...")
-        with open(FORMULAS_PATH, 'r') as f:
-            self.formulas = json.load(f)
+        self.formulas = load_corpus(FORMULAS_PATH)
         
         # 加载查询
-        with open(QUERY_PATH, 'r') as f:
-            queries_raw = json.load(f)
+        queries_raw = load_json(QUERY_PATH)
         
         self.queries = {}
         for qid, qdata in queries_raw.items():
@@ -50,26 +49,53 @@ class HashEvaluator:
             self.queries[qid] = clean_latex(latex)
         
         # 加载标准答案
-        with open(LABEL_PATH, 'r') as f:
-            self.relevance = json.load(f)
+        self.relevance = load_json(LABEL_PATH)
+        
+        # 全部查询的哈希 -> 公式 ID 一次性装入内存，评测时每条查询只是一次字典查找
+        self.hash_map = self._load_hash_map(
+            {self._hash(q) for q in self.queries.values()}
+        )
         
         print(f"   ✅ 加载完成")
         print(f"      - 数据库: {DB_PATH}")
         print(f"      - 查询数: {len(self.queries)}")
         print(f"      - 公式库: {len(self.formulas):,}")
 
+    def _load_hash_map(self, hashes):
+        """
+        {h_latex: [formula_id, ...]}，只取给定哈希对应的行（整库读入对百条查询并不划算）；
+        同一哈希下的 ID 按 rowid 排序，与 search_by_hash 的单哈希查询次序一致（两者都有 ORDER BY，可直接走 idx_latex）
+        """
+        mapping = defaultdict(list)
+        hashes = list(hashes)
+        cursor = self.conn.cursor()
+        for i in range(0, len(hashes), SQL_IN_CHUNK):
+            chunk = hashes[i:i + SQL_IN_CHUNK]
+            cursor.execute(
+                f'SELECT h_latex, formula_id FROM formula_index WHERE h_latex IN ({",".join("?" * len(chunk))}) '
+                'ORDER BY h_latex, rowid',
+                chunk
+            )
+            for h, fid in cursor.fetchall():
+                mapping[h].append(fid)
+        return {h: mapping.get(h, [])[:TOP_K] for h in hashes}
+
     def search_by_hash(self, query_latex, query_topic_id=None):
         """
         使用LaTeX哈希检索
         注意：这里只使用LaTeX哈希，因为查询没有MathML/DNA信息
         """
         # 生成查询的LaTeX哈希
-        q_hash = self.hash_gen.generate_latex_hash(query_latex)
+        q_hash = self._hash(query_latex)
+        
+        # 评测查询的哈希均已预先装入内存
+        if q_hash in self.hash_map:
+            return self.hash_map[q_hash]
         
-        # 从数据库检索匹配的公式ID
+        # 其他查询：从数据库检索匹配的公式ID
         cursor = self.conn.cursor()
         cursor.execute(
-            'SELECT formula_id FROM formula_index WHERE h_latex = ? LIMIT ?',
+            'SELECT formula_id FROM formula_index WHERE h_latex = ? ORDER BY rowid LIMIT ?',
             (q_hash, TOP_K)
         )
         results = [row[0] for row in cursor.fetchall()]
@@ -1,15 +1,13 @@
-import json
-import csv
+import pandas as pd
 from pathlib import Path
+from utils.json_io import iter_json_items
 
 def inspect_gt():
-    # 1. 加载你当前的标注
-    with open("data/processed/relevance_labels.json", 'r') as f:
-        relevance = json.load(f)
-    
+    # 1. 加载你当前的标注：只流式取出目标 Topic 的条目，其余 Topic 不驻留内存
     # 获取 B.301 的所有标准答案 ID
     target_topic = "B.301"
-    gt_ids = list(relevance.get(target_topic, {}).keys())
+    relevance = dict(iter_json_items("data/processed/relevance_labels.json", keys={target_topic}))
+    gt_ids = frozenset(relevance.get(target_topic, {}).keys())
     print(f"📊 Topic {target_topic} 在标注中有 {len(gt_ids)} 个相关公式 ID。")
     print(f"🔎 正在语料库中寻找这些 ID 的实际内容...")
 
@@ -17,17 +15,26 @@ def inspect_gt():
     # 我们随便找前 5 个分片看看
     latex_dir = Path("data/arqmath3/latex_representation_v3")
     found_count = 0
+    # 尚未找到的 ID；全部找到后立即停止扫描分片
+    remaining = set(gt_ids)
+    if not remaining:
+        return
     
     for f in sorted(latex_dir.glob("*.tsv"))[:10]: # 先看 10 个分片
-        with open(f, 'r', encoding='utf-8') as fin:
-            reader = csv.reader(fin, delimiter='\t')
-            next(reader)
-            for row in reader:
-                fid = row[0].strip()
-                if fid in gt_ids:
-                    print(f"✅ 找到匹配 ID: {fid}")
-                    print(f"   内容: {row[8]}")
-                    found_count += 1
+        # C 引擎只解析 ID 与 LaTeX 两列，再用 isin 向量化筛出候选行
+        df = pd.read_csv(f, sep='\t', usecols=[0, 8], dtype=str, engine='c',
+                         na_filter=False, encoding='utf-8')
+        fids = df.iloc[:, 0].str.strip()
+        mask = fids.isin(remaining)
+        for fid, latex in zip(fids[mask], df.iloc[:, 1][mask]):
+            if fid in remaining:
+                print(f"✅ 找到匹配 ID: {fid}")
+                print(f"   内容: {latex}")
+                found_count += 1
+                remaining.discard(fid)
+                if not remaining:
+                    print(f"🎯 全部 {len(gt_ids)} 个 ID 均已找到，停止扫描。")
+                    return
     
     if found_count == 0:
         print("\n❌ 警报：在语料库的前 10 个分片中，完全找不到标注文件里的 ID！")
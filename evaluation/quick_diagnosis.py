@@ -3,13 +3,15 @@
 解决了 formulas.json 数据结构解析问题
 """
 
-import json
+from itertools import islice
 import faiss
 import numpy as np
-import re
 from sentence_transformers import SentenceTransformer
 from pathlib import Path
 import torch
+from utils.latex_clean import clean_latex
+from utils.embedding_cache import QueryEmbeddingCache
+from utils.json_io import load_json
 
 # ==================== 配置 ====================
 MODEL_NAME = 'math-similarity/Bert-MLM_arXiv-MP-class_zbMath'
@@ -19,15 +21,6 @@ MAPPING_PATH = "artifacts/vector_id_mapping_v3.json"
 FORMULAS_PATH = "data/processed/formulas.json"
 QUERY_PATH = "data/processed/queries_full.json"
 
-def clean_latex(latex_str):
-    if not latex_str: 
-        return ""
-    latex_str = re.sub(r'\$\$?|\\\[|\\\]', '', latex_str)
-    latex_str = re.sub(r'\\dfrac|\\tfrac', r'\\frac', latex_str)
-    latex_str = re.sub(r'\\left|\\right', '', latex_str)
-    latex_str = re.sub(r'\s+', ' ', latex_str.strip())
-    return latex_str.lower()
-
 def run_diagnosis():
     print("="*70)
     print("🔬 开始快速诊断...")
@@ -57,13 +50,12 @@ def run_diagnosis():
     # ==================== 检查2: 数据结构检查 ====================
     print("\n[检查2] 数据结构检查...")
     
-    # 🔧 修复：正确读取formulas.json（完整JSON）
+    # 🔧 修复：正确读取formulas.json（完整JSON，orjson 可用时用其解析）
     print("   正在读取 formulas.json...")
-    with open(FORMULAS_PATH, 'r') as f:
-        formulas_dict = json.load(f)
+    formulas_dict = load_json(FORMULAS_PATH)
     
     # 检查数据结构
-    sample_ids = list(formulas_dict.keys())[:3]
+    sample_ids = list(islice(formulas_dict, 3))
     print(f"   ✅ formulas.json 加载成功，共 {len(formulas_dict):,} 条公式")
     print(f"   前3个ID: {sample_ids}")
     
@@ -92,10 +84,9 @@ def run_diagnosis():
     
     # 检查queries.json
     print("\n   正在读取 queries.json...")
-    with open(QUERY_PATH, 'r') as f:
-        queries_dict = json.load(f)
+    queries_dict = load_json(QUERY_PATH)
     
-    sample_qids = list(queries_dict.keys())[:3]
+    sample_qids = list(islice(queries_dict, 3))
     print(f"   ✅ queries.json 加载成功，共 {len(queries_dict)} 条查询")
     print(f"   前3个查询ID: {sample_qids}")
     
@@ -139,8 +130,7 @@ def run_diagnosis():
         print(f"   ❌ 索引加载失败: {e}")
         return
     
-    with open(MAPPING_PATH, 'r') as f:
-        fids = json.load(f)
+    fids = load_json(MAPPING_PATH)
     print(f"   ✅ ID映射加载成功: {len(fids):,} 条")
     
     # ==================== 检查4: 向量一致性测试 ====================
@@ -209,25 +199,31 @@ def run_diagnosis():
     print("\n[检查5] 真实查询测试...")
     
     # 测试前3个查询
+    query_texts = []
     for qid in sample_qids[:3]:
         query_raw = queries_dict[qid]
         
         if isinstance(query_raw, dict):
-            query_text = query_raw.get('latex') or query_raw.get('latex_norm', '')
+            query_texts.append(query_raw.get('latex') or query_raw.get('latex_norm', ''))
         else:
-            query_text = query_raw
-        
-        query_clean = clean_latex(query_text)
-        
+            query_texts.append(query_raw)
+    query_cleans = [clean_latex(q) for q in query_texts]
+    
+    # 查询向量走磁盘缓存（检查4 的编码一致性测试仍现场编码），未命中的一次批量编码、一次批量检索
+    # （模型以默认 FP32 加载，精度计入缓存键）
+    query_embs = QueryEmbeddingCache(MODEL_NAME, "fp32").encode(
+        query_cleans,
+        lambda misses: model.encode(misses, normalize_embeddings=True, convert_to_numpy=True).astype('float32')
+    )
+    D_all, I_all = index.search(query_embs, 3) if query_cleans else (None, None)
+    
+    for i, (qid, query_text, query_clean) in enumerate(zip(sample_qids, query_texts, query_cleans)):
         print(f"\n   查询 [{qid}]:")
         print(f"      原始: {query_text[:60]}...")
         print(f"      clean: {query_clean[:60]}...")
         
-        query_emb = model.encode([query_clean], normalize_embeddings=True, convert_to_numpy=True).astype('float32')
-        D, I = index.search(query_emb, 3)
-        
         print(f"      Top-3结果:")
-        for rank, (idx, dist) in enumerate(zip(I[0], D[0])):
+        for rank, (idx, dist) in enumerate(zip(I_all[i], D_all[i])):
             result_id = fids[idx]
             result_item = formulas_dict.get(result_id, {})
             if isinstance(result_item, dict):
@@ -3,6 +3,7 @@ import logging
 from tqdm import tqdm
 from retrieval.approach0_hash import DualHashGenerator
 from retrieval.indexer import FormulaIndexer
+from evaluation.eval_runner import hit_matrix, recall_and_mrr
 
 def run_eval():
     indexer = FormulaIndexer()
@@ -18,8 +19,9 @@ def run_eval():
         print(f"❌ 错误: 找不到必要的数据文件 ({e.filename})")
         return
 
-    total_recall = 0
-    count = 0
+    # 逐查询只做检索，召回率在 (Nq, K) 命中矩阵上统一计算
+    retrieved_list = []
+    gt_list = []
 
     print(f"🚀 开始评测 {len(queries)} 条查询...")
 
@@ -44,14 +46,10 @@ def run_eval():
             
         # 生成查询哈希并从数据库召回
         h = hash_gen.get_dual_hash(qdata['latex_norm'], qdata['mathml_skel'])
-        retrieved = set(indexer.retrieve(h['h_latex'], h['h_dna']))
-        
-        # 计算 Recall
-        hits = len(gt.intersection(retrieved))
-        recall_score = hits / len(gt)
-        total_recall += recall_score
-        count += 1
+        retrieved_list.append(list(set(indexer.retrieve(h['h_latex'], h['h_dna']))))
+        gt_list.append(gt)
 
+    count = len(gt_list)
     # --- 核心修复：防止除零 ---
     if count == 0:
         print("\n❌ 评测失败: 未能匹配到任何有效的查询 ID。")
@@ -60,7 +58,8 @@ def run_eval():
     else:
         print(f"\n✅ 评测完成！")
         print(f"📊 成功匹配查询数: {count}")
-        print(f"📊 平均召回率 (Mean Recall): {total_recall/count:.2%}")
+        recalls, _ = recall_and_mrr(hit_matrix(retrieved_list, gt_list), [len(gt) for gt in gt_list])
+        print(f"📊 平均召回率 (Mean Recall): {recalls.mean():.2%}")
 
 if __name__ == "__main__":
     run_eval()
\ No newline at end of file
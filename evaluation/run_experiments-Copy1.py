@@ -1,10 +1,11 @@
 import pandas as pd
 import numpy as np
-import json
 import time
 import scipy.stats as stats
 from collections import defaultdict
 import os
+from retrieval.rank_fusion import rank_by_score, build_rrf_layout, pack_rrf_layouts, rrf_from_packed
+from utils.json_io import load_json_cached
 
 # 核心评估库：pip install pytrec_eval
 try:
@@ -23,23 +24,30 @@ class LS_MIR_ExperimentRunner:
         """
         print(f"[{time.strftime('%H:%M:%S')}] 加载实验数据...")
         
-        with open(qrel_path, 'r') as f:
-            self.qrel = json.load(f)
-        with open(str_results_path, 'r') as f:
-            self.str_run = json.load(f)
-        with open(sem_results_path, 'r') as f:
-            self.sem_run = json.load(f)
+        # orjson 解析 + 同名 .pkl 缓存：JSON 未改动时重复运行直接 pickle.load
+        self.qrel = load_json_cached(qrel_path)
+        self.str_run = load_json_cached(str_results_path)
+        self.sem_run = load_json_cached(sem_results_path)
             
         self.query_metadata = {}
         if query_metadata_path and os.path.exists(query_metadata_path):
-            with open(query_metadata_path, 'r') as f:
-                self.query_metadata = json.load(f) # {qid: {"latex": "...", "length": 45}}
+            self.query_metadata = load_json_cached(query_metadata_path) # {qid: {"latex": "...", "length": 45}}
 
         # 初始化评估器
         self.evaluator = pytrec_eval.RelevanceEvaluator(
             self.qrel, {'recip_rank', 'ndcg_cut_10', 'map', 'P_1'}
         )
         self.lsmir_run_cache = None
+        # 两个流的排名与文档下标布局只与 run 本身有关（与 k 无关），排序一次供所有 RRF 调用复用
+        self._rrf_packed = self._pack_rankings(self.str_run, self.sem_run)
+
+    @staticmethod
+    def _pack_rankings(run_str, run_sem):
+        """按 run_str 的查询把两个流的排名拼接为 rrf_from_packed 所需的扁平数组"""
+        return pack_rrf_layouts({
+            qid: build_rrf_layout([rank_by_score(run_str[qid]), rank_by_score(run_sem[qid])])
+            for qid in run_str.keys()
+        })
 
     # --- 核心融合算法 ---
     def reciprocal_rank_fusion(self, run_str, run_sem, k=60):
@@ -48,16 +56,16 @@ class LS_MIR_ExperimentRunner:
         fusion_run = defaultdict(dict)
         qids = run_str.keys()
         
-        for qid in qids:
-            # 获取两个流的排名
-            docs_str = sorted(run_str[qid].items(), key=lambda x: x[1], reverse=True)
-            docs_sem = sorted(run_sem[qid].items(), key=lambda x: x[1], reverse=True)
-            
-            # 计算得分
-            for rank, (doc_id, _) in enumerate(docs_str):
-                fusion_run[qid][doc_id] = fusion_run[qid].get(doc_id, 0) + 1.0 / (k + rank + 1)
-            for rank, (doc_id, _) in enumerate(docs_sem):
-                fusion_run[qid][doc_id] = fusion_run[qid].get(doc_id, 0) + 1.0 / (k + rank + 1)
+        # 获取两个流的排名：传入的是加载时的 run 时，直接复用预先排好的扁平布局
+        if run_str is self.str_run and run_sem is self.sem_run:
+            packed = self._rrf_packed
+        else:
+            packed = self._pack_rankings(run_str, run_sem)
+        
+        # 计算得分（全部查询一次累加；两路均为空时不产生该查询，与逐条累加一致）
+        for qid, scores in rrf_from_packed(packed, (1.0, 1.0), k).items():
+            if scores:
+                fusion_run[qid] = scores
         
         latency = (time.perf_counter() - start_time) / len(qids) * 1000 # 毫秒
         return fusion_run, latency
@@ -66,11 +74,15 @@ class LS_MIR_ExperimentRunner:
         """线性得分融合 (用于消融实验对比)"""
         fusion_run = defaultdict(dict)
         for qid in run_str.keys():
-            all_docs = set(run_str[qid].keys()) | set(run_sem[qid].keys())
-            for doc_id in all_docs:
-                s_str = run_str[qid].get(doc_id, 0)
-                s_sem = run_sem[qid].get(doc_id, 0)
-                fusion_run[qid][doc_id] = alpha * s_str + (1 - alpha) * s_sem
+            # 两路文档映射到同一下标空间，得分写入稠密数组（缺失记 0），一次向量运算完成融合
+            doc_ids, (idx_str, idx_sem) = build_rrf_layout([run_str[qid].keys(), run_sem[qid].keys()])
+            if not doc_ids:
+                continue
+            s_str = np.zeros(len(doc_ids))
+            s_sem = np.zeros(len(doc_ids))
+            s_str[idx_str] = np.fromiter(run_str[qid].values(), dtype=np.float64, count=idx_str.size)
+            s_sem[idx_sem] = np.fromiter(run_sem[qid].values(), dtype=np.float64, count=idx_sem.size)
+            fusion_run[qid] = dict(zip(doc_ids, (alpha * s_str + (1 - alpha) * s_sem).tolist()))
         return fusion_run
 
     # --- 实验模块 ---
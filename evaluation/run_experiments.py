@@ -253,14 +253,25 @@
 #     evaluator.run_complexity_analysis()
 
 
-import json
+import heapq
 import numpy as np
 import pandas as pd
 from collections import defaultdict
+from operator import itemgetter
 from scipy import stats
 from tabulate import tabulate
+import os
 import re
 import time # 确保在文件顶部导入了 time
+from concurrent.futures import ProcessPoolExecutor
+from retrieval.rank_fusion import build_rrf_layout, pack_rrf_layouts, rrf_from_packed
+from utils.json_io import load_json_cached
+
+# nDCG@10 的折损倒数表 1/log2(i+2)：按名次直接取值，不再逐个调用 np.log2
+NDCG_K = 10
+_NDCG_DISCOUNTS = 1.0 / np.log2(np.arange(2, NDCG_K + 2))
+# 每个查询只保留各流的前 RUN_DEPTH 名参与融合与评测
+RUN_DEPTH = 1000
 
 class Evaluator:
     def __init__(self, qrel_path, sem_path, str_path, query_path):
@@ -272,12 +283,30 @@ class Evaluator:
 
     def load_data(self):
         print(f"📂 正在加载数据源...")
-        with open(self.qrel_path, 'r') as f: self.qrels = json.load(f)
-        with open(self.sem_path, 'r') as f: self.sem_run = json.load(f)
-        with open(self.str_path, 'r') as f: self.str_run = json.load(f)
-        with open(self.query_path, 'r') as f: self.queries = json.load(f)
+        # orjson 解析 + 同名 .pkl 缓存：JSON 未改动时重复运行直接 pickle.load
+        self.qrels = load_json_cached(self.qrel_path)
+        self.sem_run = load_json_cached(self.sem_path)
+        self.str_run = load_json_cached(self.str_path)
+        self.queries = load_json_cached(self.query_path)
+        # JSON 对象的键一律是字符串：qrels 与两个 run 的 doc_id 类型天然一致，指标计算中不再逐个 str() 转换
+        # 两个 run 截断为前 RUN_DEPTH 名并按分数降序存放（heapq.nlargest 为 O(n log K)，同分保持原顺序）
+        self.sem_run = self._top_depth(self.sem_run)
+        self.str_run = self._top_depth(self.str_run)
+        # RRF 的排名与文档下标布局只取决于输入 run，与 k / 权重无关：
+        # 加载时构建一次（run 已按名次排列）并拼接为扁平数组，权重搜索与复杂度分析中的每次融合直接复用
+        self._rrf_packed = pack_rrf_layouts({
+            qid: build_rrf_layout([list(self.sem_run.get(qid, {})), list(self.str_run.get(qid, {}))])
+            for qid in set(self.sem_run.keys()) | set(self.str_run.keys())
+        })
+        # 纯语义基线的指标不随融合权重变化，首次计算后缓存
+        self._baseline_cache = None
         print(f"✅ 数据加载完成。有效查询数: {len(self.qrels)}")
 
+    @staticmethod
+    def _top_depth(run):
+        """{qid: {doc_id: score}} -> 每个查询只留前 RUN_DEPTH 名，字典按分数降序"""
+        return {qid: dict(heapq.nlargest(RUN_DEPTH, docs.items(), key=itemgetter(1)))
+                for qid, docs in run.items()}
 
     def run_latency_audit(self, best_w):
         """测量融合算法的工程效率 (针对 76 个查询)"""
@@ -310,79 +339,80 @@ class Evaluator:
                 for m in metrics: metrics[m].append(0)
                 continue
             
-            # 按分数从高到低排序结果
-            retrieved = sorted(run_dict[qid].items(), key=lambda x: x[1], reverse=True)
-            relevant_docs = {str(k): v for k, v in target_docs.items() if v > 0}
+            # 按分数从高到低排序结果（加载时已截断并排好序的 run 再排序只是一次线性扫描）
+            retrieved = sorted(run_dict[qid].items(), key=itemgetter(1), reverse=True)
+            relevant_docs = {k: v for k, v in target_docs.items() if v > 0}
             
             if not relevant_docs: continue
 
             # 1. P@1
-            metrics["P@1"].append(1 if str(retrieved[0][0]) in relevant_docs else 0)
+            metrics["P@1"].append(1 if retrieved[0][0] in relevant_docs else 0)
+
+            # 相关结果的名次只扫描一遍，MRR 与 MAP 共用
+            hits_mask = np.fromiter((doc_id in relevant_docs for doc_id, _ in retrieved),
+                                    dtype=bool, count=len(retrieved))
+            hit_ranks = np.flatnonzero(hits_mask)
 
             # 2. MRR
-            mrr = 0
-            for i, (doc_id, _) in enumerate(retrieved):
-                if str(doc_id) in relevant_docs:
-                    mrr = 1.0 / (i + 1)
-                    break
+            mrr = 1.0 / (int(hit_ranks[0]) + 1) if hit_ranks.size else 0
             metrics["MRR"].append(mrr)
 
-            # 3. nDCG@10
-            dcg = 0
-            for i, (doc_id, _) in enumerate(retrieved[:10]):
-                if str(doc_id) in relevant_docs:
-                    rel = relevant_docs[str(doc_id)]
-                    dcg += rel / np.log2(i + 2)
+            # 3. nDCG@10（前 10 名的相关性数组与折损表做一次点积）
+            top_rels = np.fromiter((relevant_docs.get(doc_id, 0) for doc_id, _ in retrieved[:NDCG_K]),
+                                   dtype=np.float64)
+            dcg = float(top_rels @ _NDCG_DISCOUNTS[:top_rels.size])
             
-            rel_scores = sorted(relevant_docs.values(), reverse=True)
-            idcg = sum([rel / np.log2(i + 2) for i, rel in enumerate(rel_scores[:10])])
+            rel_scores = np.array(sorted(relevant_docs.values(), reverse=True)[:NDCG_K], dtype=np.float64)
+            idcg = float(rel_scores @ _NDCG_DISCOUNTS[:rel_scores.size])
             metrics["nDCG@10"].append(dcg / idcg if idcg > 0 else 0)
 
-            # 4. MAP
-            ap, hits = 0, 0
-            for i, (doc_id, _) in enumerate(retrieved):
-                if str(doc_id) in relevant_docs:
-                    hits += 1
-                    ap += hits / (i + 1)
+            # 4. MAP（第 j 个命中位于名次 r_j 时精度为 j / r_j，一次向量化求和）
+            ap = float((np.arange(1, hit_ranks.size + 1) / (hit_ranks + 1)).sum())
             metrics["MAP"].append(ap / len(relevant_docs) if relevant_docs else 0)
 
         return {k: np.mean(v) for k, v in metrics.items()}, metrics["MRR"]
 
     def reciprocal_rank_fusion(self, w_sem=1.0, w_str=0.3, k_rrf=60):
         """加权 RRF 融合逻辑"""
-        fused_run = defaultdict(dict)
-        all_qids = set(self.sem_run.keys()) | set(self.str_run.keys())
-        
-        for qid in all_qids:
-            scores = defaultdict(float)
-            # 处理语义流
-            if qid in self.sem_run:
-                sorted_sem = sorted(self.sem_run[qid].items(), key=lambda x: x[1], reverse=True)
-                for rank, (doc_id, _) in enumerate(sorted_sem[:1000]):
-                    scores[doc_id] += w_sem / (k_rrf + rank + 1)
-            # 处理结构流
-            if qid in self.str_run:
-                sorted_str = sorted(self.str_run[qid].items(), key=lambda x: x[1], reverse=True)
-                for rank, (doc_id, _) in enumerate(sorted_str[:1000]):
-                    scores[doc_id] += w_str / (k_rrf + rank + 1)
-            fused_run[qid] = dict(scores)
-        return fused_run
-
-    def run_dynamic_optimization(self):
-        """动态超参数搜索：寻找性能与显著性的平衡点"""
+        # 语义流、结构流的排名已在 load_data 中排好（缺失的流为空排名），
+        # 全部查询在一个扁平得分数组上一次累加（numba 可用时为 JIT 内核）
+        return defaultdict(dict, rrf_from_packed(self._rrf_packed, (w_sem, w_str), k_rrf))
+
+    def __getstate__(self):
+        # 送往权重搜索子进程时只带排名布局、标注与基线，不带原始 run / 查询字典
+        state = self.__dict__.copy()
+        for key in ("sem_run", "str_run", "queries"):
+            state.pop(key, None)
+        return state
+
+    def _eval_weight(self, w):
+        """单个 w_str 的融合、指标与配对 t 检验（可在子进程中执行）"""
+        _, mrr_s1_list = self._baseline_cache
+        fused = self.reciprocal_rank_fusion(w_sem=1.0, w_str=w)
+        metrics, mrr_list = self.calculate_metrics(fused)
+        _, p_val = stats.ttest_rel(mrr_s1_list, mrr_list)
+        return w, metrics, mrr_list, p_val
+
+    def run_dynamic_optimization(self, n_jobs=None):
+        """动态超参数搜索：寻找性能与显著性的平衡点（n_jobs 个进程并行评估各权重，默认全部核心）"""
         print("\n>>> 正在开启动态权重搜索 (Grid Search for w_str)...")
-        m_s1, mrr_s1_list = self.calculate_metrics(self.sem_run)
+        if self._baseline_cache is None:
+            self._baseline_cache = self.calculate_metrics(self.sem_run)
         
         search_results = []
         best_mrr = -1
         optimal_w = 0
         
         weights = np.arange(0.1, 1.1, 0.1)
-        for w in weights:
-            fused = self.reciprocal_rank_fusion(w_sem=1.0, w_str=w)
-            metrics, mrr_list = self.calculate_metrics(fused)
-            _, p_val = stats.ttest_rel(mrr_s1_list, mrr_list)
-            
+        n_jobs = min(n_jobs or os.cpu_count() or 1, len(weights))
+        if n_jobs > 1:
+            # 各权重相互独立；map 按输入顺序返回，表格与最优权重的选取与串行一致
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                evaluated = list(executor.map(self._eval_weight, weights))
+        else:
+            evaluated = [self._eval_weight(w) for w in weights]
+        
+        for w, metrics, mrr_list, p_val in evaluated:
             res = {
                 "w_str": round(w, 1),
                 "P@1": metrics["P@1"],
@@ -2,11 +2,11 @@ import json
 import torch
 import faiss
 import numpy as np
-import re
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 from pathlib import Path
 from collections import defaultdict
+from utils.latex_clean import clean_latex
 
 # ==================== 配置参数 (必须与构建脚本一致) ====================
 MODEL_NAME = 'math-similarity/Bert-MLM_arXiv-MP-class_zbMath'
@@ -17,29 +17,6 @@ LABEL_PATH = "data/processed/relevance_labels.json"
 QUERY_PATH = "data/processed/queries_full.json"
 TOP_K = 1000
 
-# =========================== 🔧 统一的LaTeX清洗函数 ===========================
-def clean_latex(latex_str):
-    """
-    ⚠️  必须与prepare_final_arqmath.py和build_full_4090_v3.py完全一致！
-    """
-    if not latex_str: 
-        return ""
-    
-    # 移除数学模式标记
-    latex_str = re.sub(r'\$\$?|\\\[|\\\]', '', latex_str)
-    
-    # 标准化命令
-    latex_str = re.sub(r'\\dfrac|\\tfrac', r'\\frac', latex_str)
-    latex_str = re.sub(r'\\left|\\right', '', latex_str)
-    
-    # 压缩空格
-    latex_str = re.sub(r'\s+', ' ', latex_str.strip())
-    
-    # 小写化
-    latex_str = latex_str.lower()
-    
-    return latex_str
-
 # =========================== 评测引擎 ===========================
 class MathEvaluator:
     def __init__(self):
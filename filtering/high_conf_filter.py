@@ -4,8 +4,13 @@ logger = logging.getLogger(__name__)
 class HighConfidenceFilter:
     def __init__(self, sts_model):
         self.sts_model = sts_model
+        # 消融实验关闭过滤时置为 False，apply 直接原样返回候选
+        self.enabled = True
     
     def apply(self, query, candidates):
+        if not self.enabled:
+            return candidates
+        
         query_latex = query["latex"]
         
         if not candidates:
@@ -82,6 +82,74 @@ import re
 import hashlib
 import pickle
 from pathlib import Path
+from collections.abc import Mapping
+
+import numpy as np
+
+# 可选：xxh3_128 非加密哈希（指纹仅作字典键，无需抗碰撞攻击）
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+# 可选：google-re2 (DFA 引擎)，用于长文本批量清洗
+try:
+    import re2
+    RE2_AVAILABLE = True
+except ImportError:
+    RE2_AVAILABLE = False
+
+# 默认沿用 md5，保证与已构建的 pkl / SQLite 索引兼容
+DEFAULT_HASH_ALGO = 'md5'
+
+# 指纹函数同时接受 str 与 bytes（clean_latex_bytes 的结果无需再编码）
+def _md5_hexdigest(s):
+    return hashlib.md5(s if isinstance(s, bytes) else s.encode('utf-8')).hexdigest()
+
+def _md5_digest(s):
+    return hashlib.md5(s if isinstance(s, bytes) else s.encode('utf-8')).digest()
+
+def _get_hash_funcs(hash_algo):
+    """返回 (hexdigest, digest) 两种形式的指纹函数"""
+    if hash_algo == 'md5':
+        return _md5_hexdigest, _md5_digest
+    if hash_algo == 'xxh3_128':
+        if not XXHASH_AVAILABLE:
+            raise ImportError("hash_algo='xxh3_128' 需要 xxhash: pip install xxhash")
+        return xxhash.xxh3_128_hexdigest, xxhash.xxh3_128_digest
+    raise ValueError(f"未知的哈希算法: {hash_algo}")
+
+# 在 ASCII 范围内与 str 正则 \s / str.split() 一致的空白字符（含 \x1c-\x1f）
+_ASCII_WS = b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f '
+_ASCII_WS_CLASS = rb'[\t-\r\x1c- ]'
+
+def _as_key(h):
+    """索引键统一为 16 字节原始摘要；兼容传入 32 位十六进制字符串"""
+    return bytes.fromhex(h) if isinstance(h, str) else h
+
+def _trie_pattern(words):
+    """
+    将字面量集合编译为前缀树形式的正则（Aho-Corasick 式共享前缀）：
+    每个位置只沿前缀树走一次，而不是逐个尝试所有候选词；
+    贪婪的可选后缀保证与“长词优先”的交替正则匹配结果一致
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        is_end = '' in node
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 and not is_end else '(?:' + '|'.join(alts) + ')'
+        return body + ('?' if is_end else '')
+
+    return build(trie)
 
 # 专家级符号映射表：解决写法异构（如 \| vs ||, ^H vs ^T）
 LATEX_SYMBOL_MAPPING = {
@@ -112,56 +180,279 @@ LATEX_SYMBOL_MAPPING = {
 }
 
 class DualHashGenerator:
-    def __init__(self):
+    def __init__(self, hash_algo=DEFAULT_HASH_ALGO, use_re2=False):
+        self.hash_algo = hash_algo
+        self._hash_func, self._digest_func = _get_hash_funcs(hash_algo)
         self.font_commands = [
             r'\\mathbf', r'\\mathrm', r'\\mathit', r'\\mathsf', r'\\mathtt', 
             r'\\mathbb', r'\\mathcal', r'\\mathfrak', r'\\text', r'\\bm'
         ]
         self.sorted_symbols = sorted(LATEX_SYMBOL_MAPPING.items(), key=lambda x: len(x[0]), reverse=True)
 
+        # 预编译正则：将原先逐条 replace / re.sub 合并为少数几次扫描。
+        # use_re2 时仅含 ASCII 字面量的模式交给 re2 编译；含 \s 的模式保留标准库 re，
+        # 因为 re2 的 \s 不匹配 Unicode 空白，会改变清洗结果。
+        # 注意：对常见的短公式 re2 的调用开销反而更大，故默认关闭
+        if use_re2 and not RE2_AVAILABLE:
+            raise ImportError("use_re2=True 需要 google-re2: pip install google-re2")
+        engine = re2 if use_re2 else re
+        self.delim_pattern = engine.compile(r'\$\$?|\\\[|\\\]')
+        # 符号别名合并为一个前缀树正则（长词优先）。
+        # 替换值取“逐条 replace”作用于该词本身的结果，以保留原有的级联效果
+        # （如 \gets -> \leftarrow -> \leqftarrow），保证已有索引的哈希不变
+        tokens = [old for old, _ in self.sorted_symbols]
+        # \Vert 前紧跟反斜杠时，原实现会再被 \| 规则替换一次
+        tokens.append(r'\\Vert')
+        tokens.sort(key=len, reverse=True)
+        self.sub_table = {tok: self._replace_sequential(tok) for tok in tokens}
+        self.symbol_pattern = engine.compile(_trie_pattern(tokens))
+        # 矩阵环境 + 装饰符 + 空白合并为一次扫描
+        self.layout_pattern = re.compile(
+            r'\\(begin|end)\{[pbvV]matrix\}|\\left|\\right|\\displaystyle|\\limits|\s+'
+        )
+        self.brace_pattern = engine.compile(r'\{+([^{}]+)\}+')
+
+        # bytes 版本（clean_latex_bytes 用）：规则均为 ASCII 字面量，直接编码复用。
+        # bytes 正则的 \s 只含 [ \t\n\r\f\v]，而 str 的 \s 还包括 \x1c-\x1f，需显式列出
+        self.font_commands_b = [cmd.encode('ascii') for cmd in self.font_commands]
+        self.sub_table_b = {k.encode('ascii'): v.encode('ascii') for k, v in self.sub_table.items()}
+        self.delim_bpattern = re.compile(rb'\$\$?|\\\[|\\\]')
+        self.symbol_bpattern = re.compile(_trie_pattern(tokens).encode('ascii'))
+        self.layout_bpattern = re.compile(
+            rb'\\(begin|end)\{[pbvV]matrix\}|\\left|\\right|\\displaystyle|\\limits|' + _ASCII_WS_CLASS + rb'+'
+        )
+        self.brace_bpattern = re.compile(rb'\{+([^{}]+)\}+')
+
+    def _replace_sequential(self, s):
+        """原始的逐条替换语义，仅用于构建 sub_table"""
+        for old, new in self.sorted_symbols:
+            s = s.replace(old, new)
+        return s
+
+    def _sub_symbol(self, m):
+        return self.sub_table[m.group(0)]
+
+    @staticmethod
+    def _sub_layout(m):
+        env = m.group(1)
+        return f'\\{env}{{matrix}}' if env else ''
+
+    def _sub_symbol_b(self, m):
+        return self.sub_table_b[m.group(0)]
+
+    @staticmethod
+    def _sub_layout_b(m):
+        env = m.group(1)
+        return b'\\' + env + b'{matrix}' if env else b''
+
     def clean_latex(self, latex_str):
         """增强型清洗：返回 (清洗后的字符串, 是否被修改)"""
         if not latex_str: return "", False
-        original = latex_str
+        
+        # 快速路径：所有规则都以 \\、$、^ 或 { 为锚点，不含这些字符时只需去除空白，
+        # 且此时结果与基础清洗相同，必然未被增强规范化
+        if ('\\' not in latex_str and '$' not in latex_str
+                and '^' not in latex_str and '{' not in latex_str):
+            return ''.join(latex_str.split()), False
         
         # 1. 移除定界符
-        s = re.sub(r'\$\$?|\\\[|\\\]', '', latex_str)
-        # 2. 剥离字体装饰
-        for cmd in self.font_commands:
-            s = s.replace(cmd, '')
+        s = base = self.delim_pattern.sub('', latex_str)
+        # 2. 剥离字体装饰（字体命令均含连续两个反斜杠，绝大多数公式可直接跳过）
+        if '\\\\' in s:
+            for cmd in self.font_commands:
+                s = s.replace(cmd, '')
         # 3. 符号别名替换
-        for old, new in self.sorted_symbols:
-            s = s.replace(old, new)
-        # 4. 统一矩阵环境
-        s = re.sub(r'\\begin\{(p|b|v|V)matrix\}', r'\\begin{matrix}', s)
-        s = re.sub(r'\\end\{(p|b|v|V)matrix\}', r'\\end{matrix}', s)
-        # 5. 移除格式装饰符与空格
-        s = re.sub(r'\\left|\\right|\\displaystyle|\\limits', '', s)
-        s = re.sub(r'\s+', '', s.strip())
+        s = self.symbol_pattern.sub(self._sub_symbol, s)
+        # 4-5. 统一矩阵环境，移除格式装饰符与空格
+        s = self.layout_pattern.sub(self._sub_layout, s)
         # 6. 简化多余大括号
-        s = re.sub(r'\{+([^{}]+)\}+', r'{\1}', s)
+        s = self.brace_pattern.sub(r'{\1}', s)
         
-        # 判定是否发生了增强规范化操作
-        base_clean = re.sub(r'\s+', '', re.sub(r'\$\$?|\\\[|\\\]', '', original)).strip()
+        # 判定是否发生了增强规范化操作（基础清洗 = 去定界符 + 去空白，复用第 1 步结果）
+        base_clean = ''.join(base.split())
         was_normalized = (s != base_clean)
         return s, was_normalized
 
+    def clean_latex_bytes(self, latex_bytes):
+        """
+        clean_latex 的 bytes 版本：输入 UTF-8 字节串，返回 (清洗后的 bytes, 是否被修改)。
+        结果可直接送入 generate_latex_digest，省去 str 编解码往返；与 clean_latex 逐字节一致
+        """
+        if not latex_bytes: return b"", False
+        # 非 ASCII 输入的空白语义（如全角空格）只有 str 正则能正确处理，回退到 str 版本
+        if not latex_bytes.isascii():
+            s, was_normalized = self.clean_latex(latex_bytes.decode('utf-8'))
+            return s.encode('utf-8'), was_normalized
+
+        # 快速路径：同 clean_latex
+        if (b'\\' not in latex_bytes and b'$' not in latex_bytes
+                and b'^' not in latex_bytes and b'{' not in latex_bytes):
+            return latex_bytes.translate(None, _ASCII_WS), False
+
+        s = base = self.delim_bpattern.sub(b'', latex_bytes)
+        if b'\\\\' in s:
+            for cmd in self.font_commands_b:
+                s = s.replace(cmd, b'')
+        s = self.symbol_bpattern.sub(self._sub_symbol_b, s)
+        s = self.layout_bpattern.sub(self._sub_layout_b, s)
+        s = self.brace_bpattern.sub(rb'{\1}', s)
+
+        was_normalized = (s != base.translate(None, _ASCII_WS))
+        return s, was_normalized
+
     def generate_latex_hash(self, clean_latex):
         if not clean_latex: return ""
-        return hashlib.md5(clean_latex.encode('utf-8')).hexdigest()
+        return self._hash_func(clean_latex)
+
+    def generate_latex_hash_batch(self, clean_latex_list):
+        """批量生成指纹：与逐条调用 generate_latex_hash 结果一一对应"""
+        hash_func = self._hash_func
+        return [hash_func(s) if s else "" for s in clean_latex_list]
+
+    def generate_latex_digest(self, clean_latex):
+        """与 generate_latex_hash 相同的指纹，但返回 16 字节原始摘要（索引键用）"""
+        if not clean_latex: return b""
+        return self._digest_func(clean_latex)
+
+    def generate_latex_digest_batch(self, clean_latex_list):
+        digest_func = self._digest_func
+        return [digest_func(s) if s else b"" for s in clean_latex_list]
+
+# 扁平二进制索引格式（替代 pickle，文件扩展名 .a0idx，与旧版 .pkl 区分）：
+#   [8B 魔数][16B 哈希算法名][uint64 n_keys]
+#   [n_keys * 16B 升序排列的摘要键]
+#   [uint64 * (n_keys + 1) 偏移：第 i 个键的 ID 位于 blob[offsets[i]:offsets[i+1]]]
+#   [blob：同一键下的 visual_id 以 '\n' 连接]
+# 加载时全部以 np.memmap 映射，无需反序列化，由操作系统按需分页
+INDEX_MAGIC = b'A0HIDX01'
+_HEADER_SIZE = len(INDEX_MAGIC) + 16 + 8
+_KEY_SIZE = 16
+
+class PackedHashIndex(Mapping):
+    """
+    内存映射的只读索引：摘要键 -> visual_id 列表。
+    search 为对有序键数组的二分查找 (np.searchsorted)，O(log N)
+    """
+    def __init__(self, keys, offsets, blob):
+        self._keys = keys          # (n,) S16，用于二分查找
+        self._raw_keys = keys.view(np.uint8).reshape(-1, _KEY_SIZE)  # 精确比较（S 类型会截掉尾部 \0）
+        self._offsets = offsets
+        self._blob = blob
+
+    def _ids_at(self, i):
+        lo, hi = self._offsets[i], self._offsets[i + 1]
+        return self._blob[lo:hi].tobytes().decode('utf-8').split('\n')
+
+    def _find(self, key):
+        if len(key) != _KEY_SIZE:
+            return -1
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._raw_keys[i].tobytes() == key:
+            return i
+        return -1
+
+    def __getitem__(self, key):
+        i = self._find(key) if isinstance(key, bytes) else -1
+        if i < 0:
+            raise KeyError(key)
+        return self._ids_at(i)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        for i in range(len(self._keys)):
+            yield self._raw_keys[i].tobytes()
+
+    def values(self):
+        for i in range(len(self._keys)):
+            yield self._ids_at(i)
+
+    def items(self):
+        for i in range(len(self._keys)):
+            yield self._raw_keys[i].tobytes(), self._ids_at(i)
+
+def _save_packed(path, hash_algo, index):
+    keys = sorted(index)
+    id_bytes = [('\n'.join(index[k])).encode('utf-8') for k in keys]
+    offsets = np.zeros(len(keys) + 1, dtype='<u8')
+    if id_bytes:
+        np.cumsum([len(b) for b in id_bytes], out=offsets[1:])
+    with open(path, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(hash_algo.encode('ascii').ljust(16, b'\0'))
+        f.write(np.uint64(len(keys)).astype('<u8').tobytes())
+        f.write(np.array(keys, dtype=f'S{_KEY_SIZE}').tobytes())
+        f.write(offsets.tobytes())
+        for b in id_bytes:
+            f.write(b)
+
+def _load_packed(path):
+    """返回 (hash_algo, PackedHashIndex)；非该格式的文件返回 None"""
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER_SIZE)
+    if not header.startswith(INDEX_MAGIC):
+        return None
+    hash_algo = header[len(INDEX_MAGIC):len(INDEX_MAGIC) + 16].rstrip(b'\0').decode('ascii')
+    n_keys = int(np.frombuffer(header, dtype='<u8', count=1, offset=len(INDEX_MAGIC) + 16)[0])
+    if n_keys == 0:
+        empty = PackedHashIndex(np.empty(0, dtype=f'S{_KEY_SIZE}'),
+                                np.zeros(1, dtype='<u8'), np.empty(0, dtype=np.uint8))
+        return hash_algo, empty
+    keys_end = _HEADER_SIZE + n_keys * _KEY_SIZE
+    keys = np.memmap(path, dtype=f'S{_KEY_SIZE}', mode='r', offset=_HEADER_SIZE, shape=(n_keys,))
+    offsets = np.memmap(path, dtype='<u8', mode='r', offset=keys_end, shape=(n_keys + 1,))
+    blob_start = keys_end + (n_keys + 1) * 8
+    blob_size = int(offsets[-1])
+    if blob_size:
+        blob = np.memmap(path, dtype=np.uint8, mode='r', offset=blob_start, shape=(blob_size,))
+    else:
+        blob = np.empty(0, dtype=np.uint8)
+    return hash_algo, PackedHashIndex(keys, offsets, blob)
 
 class Approach0HashIndex:
-    def __init__(self):
-        self.index = {} # key: hash, value: list of visual_ids
+    def __init__(self, hash_algo=DEFAULT_HASH_ALGO):
+        self.hash_algo = hash_algo
+        self.index = {} # key: 16 字节摘要, value: list of visual_ids
 
     def load(self, path):
+        """
+        读取索引：save 写出的扁平二进制格式 (approach0_index.a0idx)；
+        指定文件不存在而同名旧版 .pkl 存在时，回退读取旧版 pickle 索引（只读兼容，保存一律为新格式）
+        """
+        if not Path(path).exists() and Path(path).with_suffix('.pkl').exists():
+            path = Path(path).with_suffix('.pkl')
         if Path(path).exists():
-            with open(path, 'rb') as f:
-                self.index = pickle.load(f)
+            packed = _load_packed(path)
+            if packed is not None:
+                stored_algo, index = packed
+            else:
+                # 兼容旧版 pickle 索引
+                with open(path, 'rb') as f:
+                    data = pickle.load(f)
+                # 旧版索引直接 pickle 了 dict，一律视为 md5
+                if 'hash_algo' in data and 'index' in data:
+                    stored_algo, index = data['hash_algo'], data['index']
+                else:
+                    stored_algo, index = 'md5', data
+                # 旧版索引以十六进制字符串为键，加载时转换为原始摘要
+                if index and isinstance(next(iter(index)), str):
+                    index = {_as_key(h): vids for h, vids in index.items()}
+            if stored_algo != self.hash_algo:
+                raise ValueError(
+                    f"索引哈希算法不匹配: {path} 使用 {stored_algo}, 当前为 {self.hash_algo}"
+                )
+            self.index = index
 
     def save(self, path):
-        with open(path, 'wb') as f:
-            pickle.dump(self.index, f)
+        _save_packed(path, self.hash_algo, self.index)
+
+    def add(self, h_latex, visual_id):
+        # 已加载的只读映射索引在追加前转为普通 dict
+        if not isinstance(self.index, dict):
+            self.index = dict(self.index.items())
+        self.index.setdefault(_as_key(h_latex), []).append(visual_id)
 
     def search(self, h_latex):
-        return self.index.get(h_latex, [])
\ No newline at end of file
+        """h_latex 可以是原始摘要 (bytes) 或十六进制字符串"""
+        return self.index.get(_as_key(h_latex), [])
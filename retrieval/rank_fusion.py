@@ -1,4 +1,17 @@
+import heapq
 from collections import defaultdict
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+# 可选：numba JIT 编译 RRF 散射累加内核，未安装时回退到 NumPy 花式索引
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 def reciprocal_rank_fusion(vector_results, substructure_results, k=60, top_n=100):
     """
@@ -21,7 +34,145 @@ def reciprocal_rank_fusion(vector_results, substructure_results, k=60, top_n=100
         fid = str(item[0]) if isinstance(item, (tuple, list)) else str(item)
         rrf_scores[fid] += 1.0 / (k + rank)
 
-    # 3. 按最终 RRF 得分降序排序
-    fused_results = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
+    # 3. 按最终 RRF 得分降序取前 top_n（堆选择 O(n log top_n)，同分次序与完整排序一致）
+    return heapq.nlargest(top_n, rrf_scores.items(), key=itemgetter(1))
+
+
+def rank_by_score(run_q, top_n=None):
+    """
+    单个查询的 {doc_id: score} 按分数降序排列，返回 doc_id 数组（object）
+    与 sorted(run_q.items(), key=lambda x: x[1], reverse=True) 次序一致：稳定排序，同分保持原插入顺序
+    :param run_q: {doc_id: score}
+    :param top_n: 只保留前 top_n 名，None 为全部
+    """
+    if top_n is not None and top_n < len(run_q):
+        # 只要前 top_n 名时用堆选择，O(n log top_n)
+        top = heapq.nlargest(top_n, run_q.items(), key=itemgetter(1))
+        return np.array([doc_id for doc_id, _ in top], dtype=object)
+    doc_ids = np.array(list(run_q), dtype=object)
+    scores = np.fromiter(run_q.values(), dtype=np.float64, count=len(run_q))
+    return doc_ids[np.argsort(-scores, kind='stable')]
+
+
+def top_k_order(scores, k):
+    """
+    分数最大的 k 个下标（降序），与稳定全排序的前 k 项完全一致（并列按原下标先后）。
+    np.argpartition 线性时间选出第 k 大的分数，只对 k 个胜者排序
+    """
+    if k >= scores.size:
+        return np.argsort(-scores, kind='stable')
+    kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > kth)
+    # 边界上的并列分数取下标靠前者，与稳定排序的截断结果相同
+    ties = np.flatnonzero(scores == kth)[:k - above.size]
+    idx = np.sort(np.concatenate([above, ties]))
+    return idx[np.argsort(-scores[idx], kind='stable')]
 
-    return fused_results[:top_n]
\ No newline at end of file
+
+def build_rrf_layout(rankings):
+    """
+    把若干路排名映射到同一个文档下标空间，供 rrf_from_layout 反复使用
+    布局只取决于排名本身，与 k / 权重无关：参数扫描时每个查询只需构建一次
+    :param rankings: 若干按名次排列的 doc_id 序列
+    :return: (doc_ids, [每路排名对应的下标数组])，doc_ids 按首次出现的次序
+    """
+    doc_ids = list(dict.fromkeys(chain.from_iterable(rankings)))
+    doc_index = {d: i for i, d in enumerate(doc_ids)}
+    idx_list = [np.fromiter(map(doc_index.__getitem__, docs), dtype=np.intp, count=len(docs))
+                for docs in rankings]
+    return doc_ids, idx_list
+
+
+@lru_cache(maxsize=32)
+def _rrf_denominators(k, n):
+    """RRF 名次分母表 k + rank，rank = 1..n（只读，按 k 缓存复用）"""
+    table = (k + np.arange(1, n + 1)).astype(np.float64)
+    table.flags.writeable = False
+    return table
+
+
+def rrf_denominators(k, n):
+    """
+    前 n 名的 k + rank；表长取不小于 n 的 2 的幂，同一 k 下不同长度的排名共用一张表
+    仍以 w / (k + rank) 相除而非乘以倒数表：乘倒数会差 1 ulp，打乱原本同分文档的先后
+    """
+    return _rrf_denominators(k, 1 << (n - 1).bit_length() if n else 0)[:n]
+
+
+def rrf_from_layout(layout, weights, k=60):
+    """
+    加权 RRF（NumPy 向量化）：每路排名按 w / (k + rank) 一次累加到稠密得分数组
+    :param layout: build_rrf_layout 的返回值
+    :param weights: 与各路排名一一对应的权重
+    :param k: RRF 常数
+    :return: {doc_id: score}，键按首次出现的次序；得分与逐条 defaultdict 累加完全相同
+    """
+    doc_ids, idx_list = layout
+    scores = np.zeros(len(doc_ids))
+    for idx, w in zip(idx_list, weights):
+        # 同一路排名内 doc_id 互不相同，花式索引 += 即等价于逐个累加
+        scores[idx] += w / rrf_denominators(k, idx.size)
+    return dict(zip(doc_ids, scores.tolist()))
+
+
+def weighted_rrf(rankings, weights, k=60):
+    """加权 RRF：rankings 为若干按名次排列的 doc_id 序列，weights 为对应权重"""
+    return rrf_from_layout(build_rrf_layout(rankings), weights, k)
+
+
+def _rrf_scatter_numpy(scores, gidx, ranks, w, k):
+    """scores[gidx[i]] += w / (k + ranks[i])；gidx 互不相同"""
+    scores[gidx] += w / (k + ranks)
+
+
+if NUMBA_AVAILABLE:
+    # 单线程内核：规模仅十万级元素，线程启动开销大于计算；且权重搜索已按进程并行，
+    # 进程内再开 numba 线程池会导致线程数超额（以及 fork 后线程层的安全问题）
+    @njit(cache=True)
+    def _rrf_scatter(scores, gidx, ranks, w, k):
+        for i in range(gidx.size):
+            scores[gidx[i]] += w / (k + ranks[i])
+else:
+    _rrf_scatter = _rrf_scatter_numpy
+
+
+def pack_rrf_layouts(layouts):
+    """
+    多个查询的 RRF 布局拼接为扁平数组，rrf_from_packed 对全部查询一次累加
+    :param layouts: {qid: build_rrf_layout(...)}，各查询的排名路数相同
+    :return: (qids, doc_ids, doc_offsets, streams)；第 i 个查询的文档为 doc_ids[doc_offsets[i]:doc_offsets[i + 1]]，
+             streams[s] = (全局得分下标数组, 从 1 起的名次数组)
+    """
+    qids = list(layouts)
+    n_streams = len(layouts[qids[0]][1]) if qids else 0
+    doc_ids, doc_offsets = [], [0]
+    gidx_parts = [[] for _ in range(n_streams)]
+    rank_parts = [[] for _ in range(n_streams)]
+    for qid in qids:
+        q_doc_ids, idx_list = layouts[qid]
+        for s, idx in enumerate(idx_list):
+            gidx_parts[s].append(idx + len(doc_ids))
+            rank_parts[s].append(np.arange(1, idx.size + 1))
+        doc_ids.extend(q_doc_ids)
+        doc_offsets.append(len(doc_ids))
+    streams = [(np.concatenate(gidx_parts[s]).astype(np.int64), np.concatenate(rank_parts[s]).astype(np.int64))
+               for s in range(n_streams)]
+    return qids, doc_ids, doc_offsets, streams
+
+
+def rrf_from_packed(packed, weights, k=60):
+    """
+    全部查询的加权 RRF 一次完成：每路排名按 w / (k + rank) 散射累加到同一个扁平得分数组
+    （numba 可用时为 JIT 内核）。结果与逐查询 rrf_from_layout 完全相同
+    :param packed: pack_rrf_layouts 的返回值
+    :param weights: 与各路排名一一对应的权重
+    :param k: RRF 常数
+    :return: {qid: {doc_id: score}}
+    """
+    qids, doc_ids, doc_offsets, streams = packed
+    scores = np.zeros(len(doc_ids))
+    for (gidx, ranks), w in zip(streams, weights):
+        _rrf_scatter(scores, gidx, ranks, float(w), k)
+    scores = scores.tolist()
+    return {qid: dict(zip(doc_ids[doc_offsets[i]:doc_offsets[i + 1]], scores[doc_offsets[i]:doc_offsets[i + 1]]))
+            for i, qid in enumerate(qids)}
\ No newline at end of file
@@ -1,7 +1,10 @@
 import json
 import csv
+import os
 import sys
 import pickle
+import multiprocessing as mp
+from collections import deque
 from pathlib import Path
 from tqdm import tqdm
 
@@ -11,6 +14,22 @@ from retrieval.approach0_hash import DualHashGenerator, Approach0HashIndex
 
 csv.field_size_limit(sys.maxsize)
 
+HASH_BATCH_SIZE = 8192
+NUM_WORKERS = os.cpu_count() or 1
+
+# 每个工作进程各持有一个 DualHashGenerator（在 initializer 中创建，避免随任务反复序列化）
+_worker_hash_gen = None
+
+def _init_worker():
+    global _worker_hash_gen
+    _worker_hash_gen = DualHashGenerator()
+
+def _fingerprint_batch(raw_list):
+    """清洗并计算一批公式的指纹：raw_latex 列表 -> [(norm, was_norm, digest)]"""
+    cleaned = [_worker_hash_gen.clean_latex(raw) for raw in raw_list]
+    digests = _worker_hash_gen.generate_latex_digest_batch([norm for norm, _ in cleaned])
+    return [(norm, was_norm, d) for (norm, was_norm), d in zip(cleaned, digests)]
+
 def build_full_system():
     base_path = Path.cwd()
     latex_dir = base_path / "data" / "arqmath3" / "latex_representation_v3"
@@ -52,32 +71,55 @@ def build_full_system():
         "normalized_count": 0   # 触发增强清洗规则的
     }
 
-    print(f"🚀 启动扫描。发现分片总数: {len(all_shards)}")
-    # 如果想跑全量，不要切片；如果想先测试，可以用 all_shards[:101]
-    for shard in tqdm(all_shards, desc="Processing Shards"):
-        with open(shard, 'r', encoding='utf-8') as fin:
-            reader = csv.reader(fin, delimiter='\t')
-            next(reader, None) # 跳过表头
-            for row in reader:
-                if len(row) < 9: continue
-                stats["total_instances"] += 1
-                
-                visual_id = row[6].strip()
-                issue = row[7].strip()
-                raw_latex = row[8].strip()
-                
-                # 过滤逻辑 1: 无效公式
-                if 'd' in issue:
-                    stats["skipped_issue_d"] += 1
-                    continue
-                
-                # 过滤逻辑 2: 重复 Visual ID (核心去重点)
-                if visual_id in corpus:
-                    stats["duplicate_skipped"] += 1
-                    continue
-                
-                # 执行清洗
-                norm_latex, was_norm = hash_gen.clean_latex(raw_latex)
+    # 已分发批次的 (visual_ids, raw_latex)；imap 按提交顺序返回结果，主进程依次弹出配对，
+    # 原始 LaTeX 无需随结果传回
+    dispatched = deque()
+
+    def iter_batches():
+        """顺序扫描分片并完成过滤与去重，按 HASH_BATCH_SIZE 产出待清洗批次"""
+        seen = set()
+        pending_ids, pending_latex = [], []
+        # 如果想跑全量，不要切片；如果想先测试，可以用 all_shards[:101]
+        for shard in tqdm(all_shards, desc="Processing Shards"):
+            with open(shard, 'r', encoding='utf-8') as fin:
+                reader = csv.reader(fin, delimiter='\t')
+                next(reader, None) # 跳过表头
+                for row in reader:
+                    if len(row) < 9: continue
+                    stats["total_instances"] += 1
+                    
+                    visual_id = row[6].strip()
+                    issue = row[7].strip()
+                    raw_latex = row[8].strip()
+                    
+                    # 过滤逻辑 1: 无效公式
+                    if 'd' in issue:
+                        stats["skipped_issue_d"] += 1
+                        continue
+                    
+                    # 过滤逻辑 2: 重复 Visual ID (核心去重点)
+                    if visual_id in seen:
+                        stats["duplicate_skipped"] += 1
+                        continue
+                    seen.add(visual_id)
+                    
+                    pending_ids.append(visual_id)
+                    pending_latex.append(raw_latex)
+                    if len(pending_ids) >= HASH_BATCH_SIZE:
+                        dispatched.append((pending_ids, pending_latex))
+                        yield pending_latex
+                        pending_ids, pending_latex = [], []
+        if pending_ids:
+            dispatched.append((pending_ids, pending_latex))
+            yield pending_latex
+
+    print(f"🚀 启动扫描。发现分片总数: {len(all_shards)}，并行进程数: {NUM_WORKERS}")
+    # 清洗 + 指纹计算是逐条独立的纯函数，按批分发到进程池；
+    # 使用有序的 imap 保证 formulas.json 与索引桶内的 ID 次序与串行构建一致
+    with mp.Pool(NUM_WORKERS, initializer=_init_worker) as pool:
+        for results in pool.imap(_fingerprint_batch, iter_batches()):
+            visual_ids, raw_list = dispatched.popleft()
+            for visual_id, raw_latex, (norm_latex, was_norm, h_val) in zip(visual_ids, raw_list, results):
                 if was_norm: stats["normalized_count"] += 1
                 
                 # 入库
@@ -86,19 +128,13 @@ def build_full_system():
                     "latex": raw_latex,
                     "latex_norm": norm_latex
                 }
-                
-                # 索引哈希
-                h_val = hash_gen.generate_latex_hash(norm_latex)
-                if h_val not in h_index.index:
-                    h_index.index[h_val] = []
-                h_index.index[h_val].append(visual_id)
-                
+                h_index.add(h_val, visual_id)
                 stats["unique_visual_ids"] += 1
 
     # --- Part 3: 保存与汇总 ---
     print("\n💾 正在保存索引文件...")
     corpus_file = out_dir / "formulas.json"
-    index_file = artifact_dir / "approach0_index.pkl"
+    index_file = artifact_dir / "approach0_index.a0idx"
     
     with open(corpus_file, 'w', encoding='utf-8') as f:
         json.dump(corpus, f, ensure_ascii=False)
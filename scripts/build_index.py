@@ -96,7 +96,7 @@ def main():
     # 3. 保存索引文件
     output_dir = Path("artifacts")
     output_dir.mkdir(exist_ok=True)
-    output_path = output_dir / "approach0_index.pkl"
+    output_path = output_dir / "approach0_index.a0idx"
     
     logger.info(f"💾 Saving dual-hash index to {output_path}")
     index.save(str(output_path))
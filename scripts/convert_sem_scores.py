@@ -0,0 +1,40 @@
+import json
+import os
+import numpy as np
+
+# 配置路径 - 转换一次后，draw.py 会优先读取 npz
+SCORES_JSON = "results/raw_sem_scores.json"
+SCORES_NPZ = "results/raw_sem_scores.npz"
+
+def convert_sem_scores():
+    """
+    将 {qid: {fid: sim}} 的 JSON 转为列式 npz：
+      qids    - 查询 ID
+      offsets - 第 i 个查询的候选位于 [offsets[i], offsets[i+1])
+      fids    - 候选公式 ID（保持原 JSON 中的次序，并列分数的排序依赖它）
+      sims    - float32 相似度（原始分数仅 6 位小数，float32 足以无损区分）
+    """
+    print(f"[*] 正在读取 {SCORES_JSON} ...")
+    if not os.path.exists(SCORES_JSON):
+        print(f"❌ 错误: 找不到分数文件 {SCORES_JSON}")
+        return
+
+    with open(SCORES_JSON, "r") as f:
+        sem_scores = json.load(f)
+
+    qids = list(sem_scores.keys())
+    offsets = np.zeros(len(qids) + 1, dtype=np.int64)
+    for i, qid in enumerate(qids):
+        offsets[i + 1] = offsets[i] + len(sem_scores[qid])
+
+    fids = np.array([fid for qid in qids for fid in sem_scores[qid]])
+    sims = np.fromiter(
+        (sim for qid in qids for sim in sem_scores[qid].values()),
+        dtype=np.float32, count=int(offsets[-1])
+    )
+
+    np.savez(SCORES_NPZ, qids=np.array(qids), offsets=offsets, fids=fids, sims=sims)
+    print(f"✅ 已转换 {len(qids)} 个查询 / {offsets[-1]:,} 条候选分数 -> {SCORES_NPZ}")
+
+if __name__ == "__main__":
+    convert_sem_scores()
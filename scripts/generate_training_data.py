@@ -117,7 +117,7 @@ def main():
             labels[qid] = {fid: 1 for fid in labels[qid]}
     
     index = Approach0HashIndex()
-    index.load("artifacts/approach0_index.pkl")
+    index.load("artifacts/approach0_index.a0idx")
     
     logger.info(f"  Formulas: {len(formulas)}")
     logger.info(f"  Queries: {len(queries)}")
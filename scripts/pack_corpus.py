@@ -0,0 +1,39 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.json_io import load_json
+from utils.packed_corpus import packed_paths
+
+# 转换一次后，评测脚本经 utils.packed_corpus.load_corpus 优先读取打包文件
+FORMULAS_JSON = "data/processed/formulas.json"
+
+def pack_corpus(json_path=FORMULAS_JSON):
+    """
+    将 {fid: {"latex_norm": ...}} 的 JSON 语料打包为可内存映射的三件套：
+      *.ids.npy     - 升序的公式 ID（定长字节串，二分查找）
+      *.offsets.npy - 第 i 条公式位于 blob 的 [offsets[i], offsets[i+1])
+      *.blob        - 按 ID 次序拼接的 UTF-8 latex_norm
+    """
+    print(f"[*] 正在读取 {json_path} ...")
+    if not os.path.exists(json_path):
+        print(f"❌ 错误: 找不到语料文件 {json_path}")
+        return
+
+    corpus = load_json(json_path)
+    fids = sorted(corpus, key=lambda fid: fid.encode('utf-8'))
+    texts = [corpus[fid]['latex_norm'].encode('utf-8') for fid in fids]
+
+    offsets = np.zeros(len(fids) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=offsets[1:])
+
+    ids_path, offsets_path, blob_path = packed_paths(json_path)
+    np.save(ids_path, np.array([fid.encode('utf-8') for fid in fids], dtype=np.bytes_))
+    np.save(offsets_path, offsets)
+    with open(blob_path, 'wb') as f:
+        f.write(b''.join(texts))
+    print(f"✅ 已打包 {len(fids):,} 条公式 -> {blob_path}（{offsets[-1] / 1024**2:.1f} MB）")
+
+if __name__ == "__main__":
+    pack_corpus()
@@ -10,18 +10,24 @@ from retrieval.indexer import FormulaIndexer
 
 csv.field_size_limit(sys.maxsize)
 
+# 语料预处理对每条公式都要调用下面两个函数：正则与忽略标签集合在导入时构建一次
+_WHITESPACE_RE = re.compile(r'\s+')
+_FRAC_VARIANT_RE = re.compile(r'\\dfrac|\\tfrac')
+_LEFT_RIGHT_RE = re.compile(r'\\left|\\right')
+_XML_ATTR_RE = re.compile(r'\s+xmlns="[^"]+"|\s+encoding="[^"]+"')
+IGNORED = {'math', 'semantics', 'annotation', 'annotation-xml', 'mstyle', 'mrow', 'mtext', 'mspace'}
+
 def normalize_latex(latex_str):
     if not latex_str: return ""
-    latex_str = re.sub(r'\s+', ' ', latex_str.strip())
-    latex_str = re.sub(r'\\dfrac|\\tfrac', r'\\frac', latex_str)
-    latex_str = re.sub(r'\\left|\\right', '', latex_str)
+    latex_str = _WHITESPACE_RE.sub(' ', latex_str.strip())
+    latex_str = _FRAC_VARIANT_RE.sub(r'\\frac', latex_str)
+    latex_str = _LEFT_RIGHT_RE.sub('', latex_str)
     return latex_str.lower()
 
 def clean_mathml_to_dna(xml_str):
     """DFS 提取结构化 DNA"""
     if not xml_str: return ""
-    xml_str = re.sub(r'\s+xmlns="[^"]+"|\s+encoding="[^"]+"', '', xml_str)
-    IGNORED = {'math', 'semantics', 'annotation', 'annotation-xml', 'mstyle', 'mrow', 'mtext', 'mspace'}
+    xml_str = _XML_ATTR_RE.sub('', xml_str)
     
     def get_structure(element):
         tag = element.tag.split('}')[-1].lower()
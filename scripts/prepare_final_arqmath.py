@@ -83,10 +83,7 @@ def process_corpus(num_shards=101):
                 }
                 
                 # 构建哈希索引
-                h_val = hash_gen.generate_latex_hash(clean_norm)
-                if h_val not in h_index.index:
-                    h_index.index[h_val] = []
-                h_index.index[h_val].append(visual_id)
+                h_index.add(hash_gen.generate_latex_digest(clean_norm), visual_id)
 
     # 3. 导出
     out_dir = base_path / "data" / "processed"
@@ -96,12 +93,12 @@ def process_corpus(num_shards=101):
     with open(out_dir / "formulas.json", 'w', encoding='utf-8') as f:
         json.dump(corpus, f, ensure_ascii=False)
 
-    h_index.save(base_path / "artifacts" / "approach0_index.pkl")
+    h_index.save(base_path / "artifacts" / "approach0_index.a0idx")
     
     print(f"✅ 处理完成！")
     print(f"   - 唯一 Visual ID 数量: {len(corpus):,}")
     print(f"   - 语料元数据 -> {out_dir}/formulas.json")
-    print(f"   - 哈希索引 -> artifacts/approach0_index.pkl")
+    print(f"   - 哈希索引 -> artifacts/approach0_index.a0idx")
 
 if __name__ == "__main__":
     # 执行全流程
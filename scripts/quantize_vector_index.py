@@ -0,0 +1,51 @@
+import argparse
+import faiss
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+
+# 由已构建的精确索引 (IndexFlatIP) 离线生成近似索引；向量次序不变，
+# 因此对应的 vector_id_mapping_*.json 可直接复用
+FLAT_INDEX_PATH = Path("artifacts/vector_index_full_v4.faiss")
+FACTORIES = {
+    "hnsw": "HNSW32",          # 不压缩，图检索加速
+    "sq8": "SQ8",              # 每维 INT8 标量量化，768 字节 / 向量，暴力扫描的内存带宽降为 1/4
+    "ivfpq": "IVF4096,PQ64",   # 64 字节 / 向量（原 768 x 4 字节），约 48 倍压缩
+    "opq-ivfpq": "OPQ32_128,IVF4096,PQ32",  # OPQ 旋转降到 128 维后再 PQ，32 字节 / 向量
+}
+TRAIN_SIZE = 500000
+CHUNK_SIZE = 500000
+
+def quantize_vector_index(kind, flat_index_path=FLAT_INDEX_PATH):
+    flat_index_path = Path(flat_index_path)
+    print(f"📖 正在读取精确索引 {flat_index_path} ...")
+    flat = faiss.read_index(str(flat_index_path))
+    dim, ntotal = flat.d, flat.ntotal
+    print(f"   - 维度: {dim}, 向量数: {ntotal:,}")
+
+    index = faiss.index_factory(dim, FACTORIES[kind], faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        # 均匀抽样训练数据，避免只用语料前缀导致聚类中心偏斜
+        train_ids = np.linspace(0, ntotal - 1, min(TRAIN_SIZE, ntotal)).astype('int64')
+        print(f"📥 正在批量提取 {train_ids.size:,} 条训练向量 ...")
+        train_data = flat.reconstruct_batch(train_ids)
+        print(f"⚙️ 正在训练 {FACTORIES[kind]} ...")
+        index.train(train_data)
+        del train_data
+
+    for start in tqdm(range(0, ntotal, CHUNK_SIZE), desc="写入向量"):
+        n = min(CHUNK_SIZE, ntotal - start)
+        index.add(flat.reconstruct_n(start, n))
+
+    out_path = flat_index_path.with_name(f"{flat_index_path.stem}_{kind}.faiss")
+    faiss.write_index(index, str(out_path))
+    print(f"✅ 已生成 {out_path}（{index.ntotal:,} 条）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将精确向量索引转换为 HNSW / SQ8 / (OPQ+)IVF-PQ 近似索引")
+    parser.add_argument("--kind", choices=sorted(FACTORIES), default="hnsw")
+    parser.add_argument("--flat-index", default=str(FLAT_INDEX_PATH),
+                        help="输入的精确索引，如 artifacts/vector_index_full_v3.faiss")
+    args = parser.parse_args()
+    quantize_vector_index(args.kind, args.flat_index)
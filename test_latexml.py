@@ -244,9 +244,7 @@ def process_corpus(num_shards=101):
                 }
                 
                 # 构建哈希索引（倒排索引：hash -> [visual_ids]）
-                if h_latex not in h_index.index:
-                    h_index.index[h_latex] = []
-                h_index.index[h_latex].append(visual_id)
+                h_index.add(h_latex, visual_id)
 
     # 3. 统计报告
     print(f"\n📊 数据统计:")
@@ -273,7 +271,7 @@ def process_corpus(num_shards=101):
         json.dump(corpus, f, ensure_ascii=False)
     
     # 导出哈希索引
-    h_index.save(artifacts_dir / "approach0_index.pkl")
+    h_index.save(artifacts_dir / "approach0_index.a0idx")
     
     # 导出统计信息
     stats = {
@@ -294,7 +292,7 @@ def process_corpus(num_shards=101):
     
     print(f"\n✅ 处理完成！")
     print(f"   - 语料元数据 -> {out_dir}/formulas.json")
-    print(f"   - 哈希索引 -> {artifacts_dir}/approach0_index.pkl")
+    print(f"   - 哈希索引 -> {artifacts_dir}/approach0_index.a0idx")
     print(f"   - 统计信息 -> {out_dir}/corpus_stats.json")
 
 # =========================== 检索接口 ===========================
@@ -345,7 +343,7 @@ def diagnose_index():
     
     # 加载索引和语料
     h_index = Approach0HashIndex()
-    h_index.load(base_path / "artifacts" / "approach0_index.pkl")
+    h_index.load(base_path / "artifacts" / "approach0_index.a0idx")
     
     with open(base_path / "data" / "processed" / "formulas.json", 'r') as f:
         corpus = json.load(f)
@@ -383,8 +381,8 @@ def diagnose_index():
         print(f"   - 哈希一致: {'✅' if stored_hash == recalc_hash else '❌'}")
         
         # 检查索引中是否能找到
-        if recalc_hash in h_index.index:
-            found_vids = h_index.index[recalc_hash]
+        found_vids = h_index.search(recalc_hash)
+        if found_vids:
             print(f"   - 索引查找: ✅ 找到 {len(found_vids)} 个匹配")
             print(f"   - 本 Visual ID 在结果中: {'✅' if visual_id in found_vids else '❌'}")
         else:
@@ -403,8 +401,8 @@ def diagnose_index():
         print(f"   - 清洗后: {query_meta['clean_latex'][:60]}...")
         print(f"   - 查询哈希: {query_hash[:16]}...")
         
-        if query_hash in h_index.index:
-            matches = h_index.index[query_hash]
+        matches = h_index.search(query_hash)
+        if matches:
             print(f"   - 匹配结果: ✅ 找到 {len(matches)} 个 Visual ID")
             query_found += 1
             # 显示前 3 个匹配
@@ -463,7 +461,7 @@ def test_retrieval():
         
         results = search_formula(
             query_latex=query_latex,
-            index_path=base_path / "artifacts" / "approach0_index.pkl",
+            index_path=base_path / "artifacts" / "approach0_index.a0idx",
             corpus_path=base_path / "data" / "processed" / "formulas.json",
             top_k=10
         )
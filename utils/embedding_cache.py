@@ -0,0 +1,88 @@
+"""
+On-disk cache of query embeddings
+
+Usage:
+  from utils.embedding_cache import QueryEmbeddingCache
+
+  cache = QueryEmbeddingCache(MODEL_NAME, "fp16" if USE_FP16 else "fp32")
+  embs = cache.encode(norm_latexes, lambda misses: model.encode(misses, ...))
+
+Rows are keyed by md5(model name + inference precision + cleaned LaTeX),
+so a re-run over an unchanged query file skips the encoder entirely,
+and neither a different model nor the same model run in FP16 instead
+of FP32 ever reuses the other's vectors. Only the misses are encoded, in
+one call, and appended to artifacts/query_emb_cache.npz (rewritten
+atomically). Within a process the loaded file is shared between cache
+objects through an lru_cache'd loader.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+
+QUERY_EMB_CACHE_PATH = "artifacts/query_emb_cache.npz"
+
+
+def _key(model_name, precision, latex):
+    return hashlib.md5(f"{model_name}\0{precision}\0{latex}".encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _load(path):
+    """{key: row} and the embedding matrix stored at path (empty when absent)."""
+    if not os.path.exists(path):
+        return {}, None
+    with np.load(path) as data:
+        keys = data["keys"].tolist()
+        embs = data["embs"]
+    return {k: i for i, k in enumerate(keys)}, embs
+
+
+class QueryEmbeddingCache:
+    """
+    Persistent {md5(model, precision, latex): embedding} store for one model
+    run at one precision ("fp16" / "fp32", whatever the caller infers with).
+    """
+
+    def __init__(self, model_name, precision, path=QUERY_EMB_CACHE_PATH):
+        self.model_name = model_name
+        self.precision = precision
+        self.path = path
+
+    def encode(self, latexes, encode_fn):
+        """
+        N x D float32 embeddings for latexes, in order. encode_fn(list_of_latex)
+        is called once with the distinct cache misses and must return an
+        array-like of shape (len(misses), D).
+        """
+        latexes = list(latexes)
+        keys = [_key(self.model_name, self.precision, s) for s in latexes]
+        index, embs = _load(self.path)
+
+        misses = {}
+        for k, s in zip(keys, latexes):
+            if k not in index and k not in misses:
+                misses[k] = s
+        if misses:
+            new_embs = np.asarray(encode_fn(list(misses.values())), dtype=np.float32)
+            index, embs = self._append(index, embs, list(misses), new_embs)
+
+        if not latexes:
+            return np.zeros((0, 0 if embs is None else embs.shape[1]), dtype=np.float32)
+        return embs[[index[k] for k in keys]]
+
+    def _append(self, index, embs, new_keys, new_embs):
+        index = dict(index)
+        for k in new_keys:
+            index[k] = len(index)
+        embs = new_embs if embs is None else np.concatenate([embs, new_embs])
+        keys = np.array(sorted(index, key=index.get))
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, keys=keys, embs=embs)
+        os.replace(tmp_path, self.path)
+        _load.cache_clear()
+        return index, embs
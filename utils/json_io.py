@@ -0,0 +1,108 @@
+"""
+JSON loading helpers
+
+Usage:
+  from utils.json_io import load_json, load_json_cached
+
+  formulas = load_json("data/processed/formulas.json")
+  for qid, scores in iter_json_items("results/raw_sem_scores.json"):
+      ...
+  sem_run = load_json_cached("results/raw_sem_scores.json")
+
+orjson (C/SIMD parser) is used when installed, otherwise falls back to
+the standard library json module. Both return the same Python objects.
+iter_json_items streams a top-level object with ijson when installed.
+load_json_cached keeps a pickle of the parsed object under
+artifacts/json_cache/ (named after the JSON file plus a hash of its
+absolute path, .json.pkl suffix) and reuses it while the JSON file's
+size and mtime are unchanged.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+JSON_CACHE_DIR = "artifacts/json_cache"
+
+
+def load_json(path):
+    """Load a JSON file, preferring orjson for large corpus files."""
+    if ORJSON_AVAILABLE:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_json_items(path, keys=None):
+    """
+    Yield (key, value) pairs of a top-level JSON object one at a time.
+
+    With ijson only the current value is held in memory; without it the
+    whole file is loaded via load_json. If keys is given, entries whose
+    key is not in it are skipped (and never kept).
+    """
+    if IJSON_AVAILABLE:
+        with open(path, "rb") as f:
+            for key, value in ijson.kvitems(f, "", use_float=True):
+                if keys is None or key in keys:
+                    yield key, value
+    else:
+        for key, value in load_json(path).items():
+            if keys is None or key in keys:
+                yield key, value
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _cache_path(path):
+    """Cache file for path inside JSON_CACHE_DIR; the path hash keeps same-named sources apart."""
+    digest = hashlib.md5(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(JSON_CACHE_DIR, f"{stem}.{digest}.json.pkl")
+
+
+def load_json_cached(path):
+    """
+    Load a JSON file through an on-disk pickle cache.
+
+    The cache stores the source's (size, mtime) with the object; a stale,
+    missing or unreadable cache is rebuilt from the JSON (parsed with
+    load_json) and rewritten atomically.
+    """
+    cache_path = _cache_path(path)
+    signature = _source_signature(path)
+    try:
+        with open(cache_path, "rb") as f:
+            cached_signature, obj = pickle.load(f)
+        if cached_signature == signature:
+            return obj
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+
+    obj = load_json(path)
+    tmp_path = cache_path + ".tmp"
+    try:
+        os.makedirs(JSON_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            pickle.dump((signature, obj), f, protocol=5)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return obj
@@ -0,0 +1,51 @@
+"""
+Shared LaTeX cleaning for the evaluation scripts
+
+Usage:
+  from utils.latex_clean import clean_latex
+
+  query = clean_latex(raw_latex)                  # full cleaning, lower-cased
+  query = clean_latex(raw_latex, lower=False)     # keep case (hash alignment)
+
+The cleaning must stay identical to the one used when the indexes were
+built: strip $ / $$ / \\[ / \\] delimiters, map \\dfrac and \\tfrac to \\frac,
+drop \\left / \\right, collapse whitespace runs to one space and lower-case.
+
+Each rule is applied in the same order as the original re.sub chain, but
+a rule's regex only runs when a C-level substring test shows it can
+match, and whitespace is collapsed with str.split / str.join (the same
+Unicode whitespace set as the regex \\s). The \\dfrac/\\tfrac rewrite and
+the \\left/\\right removal share one regex pass: neither rule can create or
+destroy a match of the other, so fusing them gives the same string.
+Delimiter stripping stays a separate first pass because removing a $ can
+join text into a new command (\\d$frac -> \\dfrac), and whitespace is
+collapsed last because removing \\left can leave two adjacent spaces.
+Most formulas therefore go through one command pass and one split/join.
+"""
+
+import re
+
+_MATH_DELIM_RE = re.compile(r'\$\$?|\\\[|\\\]')
+_COMMAND_RE = re.compile(r'\\(?:[dt](frac)|left|right)')
+
+
+def _sub_command(m):
+    return '\\frac' if m.group(1) else ''
+
+
+def clean_latex(latex_str, normalize_commands=True, lower=True):
+    """
+    Clean one LaTeX string.
+
+    normalize_commands=False only strips delimiters and whitespace;
+    lower=False keeps the original case.
+    """
+    if not latex_str:
+        return ""
+    s = latex_str
+    if '$' in s or '\\[' in s or '\\]' in s:
+        s = _MATH_DELIM_RE.sub('', s)
+    if normalize_commands and '\\' in s:
+        s = _COMMAND_RE.sub(_sub_command, s)
+    s = ' '.join(s.split())
+    return s.lower() if lower else s
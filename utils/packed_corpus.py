@@ -0,0 +1,75 @@
+"""
+Packed read-only formula corpus
+
+Usage:
+  from utils.packed_corpus import load_corpus
+
+  corpus = load_corpus("data/processed/formulas.json")
+  if fid in corpus:
+      latex = corpus[fid]["latex_norm"]
+
+scripts/pack_corpus.py converts formulas.json once into three files
+next to it (formulas.ids.npy / formulas.offsets.npy / formulas.blob):
+sorted ids, offsets into the blob, and the utf-8 latex_norm strings
+concatenated in id order. PackedCorpus memory-maps them, so opening is
+O(1) and each lookup is a binary search plus one slice of the blob.
+load_corpus falls back to the JSON file when the packed files are absent.
+"""
+
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+from utils.json_io import load_json
+
+
+def packed_paths(json_path):
+    """(ids, offsets, blob) paths derived from the JSON corpus path."""
+    prefix = os.path.splitext(json_path)[0]
+    return prefix + ".ids.npy", prefix + ".offsets.npy", prefix + ".blob"
+
+
+class PackedCorpus(Mapping):
+    """{formula_id: {"latex_norm": str}} view over the memory-mapped files."""
+
+    def __init__(self, json_path):
+        ids_path, offsets_path, blob_path = packed_paths(json_path)
+        self._ids = np.load(ids_path, mmap_mode="r")
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        if os.path.getsize(blob_path):
+            self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self._blob = np.zeros(0, dtype=np.uint8)
+
+    def _find(self, fid):
+        key = str(fid).encode("utf-8")
+        if not self._ids.size or len(key) > self._ids.dtype.itemsize:
+            return -1
+        i = int(np.searchsorted(self._ids, key))
+        if i < self._ids.size and self._ids[i] == key:
+            return i
+        return -1
+
+    def __getitem__(self, fid):
+        i = self._find(fid)
+        if i < 0:
+            raise KeyError(fid)
+        text = self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+        return {"latex_norm": text}
+
+    def __contains__(self, fid):
+        return self._find(fid) >= 0
+
+    def __len__(self):
+        return int(self._ids.size)
+
+    def __iter__(self):
+        return (fid.decode("utf-8") for fid in self._ids)
+
+
+def load_corpus(json_path):
+    """PackedCorpus when the packed files exist, otherwise the parsed JSON dict."""
+    if all(os.path.exists(p) for p in packed_paths(json_path)):
+        return PackedCorpus(json_path)
+    return load_json(json_path)